@@ -1,6 +1,8 @@
-import json
 import ffmpeg
 import math
+from metrics import Metrics
+from video_io import probe_video
+from transcript_format import load_transcript, transcript_words
 
 # FUNCTIONS -------------------------
 def convert_to_ass_time(seconds: float) -> str:
@@ -12,9 +14,8 @@ def convert_to_ass_time(seconds: float) -> str:
     return f"{h}:{m:02}:{s:02}.{cs:02}"
 
 def make_ass(json_path, ass_path, resolution=(1024, 576)):
-    """Create ASS file with timestamps and settings."""
-    with open(json_path) as f:
-        data = json.load(f)
+    """Create ASS file with timestamps and settings. json_path - transcript as JSON or in the columnar format."""
+    data = load_transcript(json_path)
 
     # Header
     '''
@@ -67,40 +68,37 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
     # Add each of the subtitle lines
     subtitles = []
     
-    for segment in data['segments']:
-        for word in segment['words']:
-            word_text = word['word'].strip()
-            start_time = word['start']
-            end_time = word['end']
-            duration = end_time - start_time
-            
-            # CHANGE TO NOT BE BASED ON DURATION BUT SOMETHING ELSE
-            if duration > 0.5:
-                styles = [
-                    "Default",
-                    "Default-Red",
-                    "Default-Bold-Red",
-                    "Fancy",
-                    "Fancy-Red",
-                    "Messy",
-                    "Messy-Red",
-                    "Clean",
-                    "Clean-Red",
-                    "Crazy",
-                    "Crazy-Red",
-                    "Heavy",
-                    "Heavy-Red",
-                    "Notes",
-                    "Notes-Red",
-                    "Wild",
-                    "Wild-Red",
-                    "Sad",
-                    "Sad-Red"
-                ]
-                switch_interval = 0.05 
-                flicker_text(start_time, end_time, word_text, subtitles, styles, switch_interval)
-            else:
-                normal_text(start_time, end_time, word_text, subtitles)
+    for word, start_time, end_time in transcript_words(data):
+        word_text = word.strip()
+        duration = end_time - start_time
+        
+        # CHANGE TO NOT BE BASED ON DURATION BUT SOMETHING ELSE
+        if duration > 0.5:
+            styles = [
+                "Default",
+                "Default-Red",
+                "Default-Bold-Red",
+                "Fancy",
+                "Fancy-Red",
+                "Messy",
+                "Messy-Red",
+                "Clean",
+                "Clean-Red",
+                "Crazy",
+                "Crazy-Red",
+                "Heavy",
+                "Heavy-Red",
+                "Notes",
+                "Notes-Red",
+                "Wild",
+                "Wild-Red",
+                "Sad",
+                "Sad-Red"
+            ]
+            switch_interval = 0.05 
+            flicker_text(start_time, end_time, word_text, subtitles, styles, switch_interval)
+        else:
+            normal_text(start_time, end_time, word_text, subtitles)
 
     # Write to the ASS file
     with open(ass_path, "w", encoding="utf-8") as f:
@@ -131,14 +129,55 @@ def flicker_text(start_time, end_time, word_text, subtitles, styles, switch_inte
         line = f"Dialogue: 0,{ass_start},{ass_end},{style},,0,0,0,,{word_text}"
         subtitles.append(line)
 
-def burn_subtitles(input, output, subtitles):
-    ffmpeg.input(input).output(output, vf=f"ass={subtitles}", acodec='copy').global_args('-y').run()
-
-def combine_video_audio(video_input, audio_input, output):
-    video = ffmpeg.input(video_input)
-    audio = ffmpeg.input(audio_input)
-
-    ffmpeg.output(video.video, audio.audio, output, vcodec='copy', acodec='aac', shortest=None).global_args('-y').run()
+def subtitle_filter(subtitles, offset=0.0):
+    """ffmpeg filter that burns in subtitles, for frames whose time 0 is at offset seconds in the subtitles."""
+    if not offset:
+        return f"ass={subtitles}"
+    # ass renders by frame timestamp, so shift them into the subtitles' timeline and back
+    return f"setpts=PTS+{offset}/TB,ass={subtitles},setpts=PTS-{offset}/TB"
+
+def range_args(start=0.0, end=None):
+    """ffmpeg input options that decode only [start, end) seconds (accurate seek when re-encoding)."""
+    args = {}
+    if start:
+        args['ss'] = start
+    if end is not None:
+        args['t'] = end - start
+    return args
+
+def burn_subtitles(input, output, subtitles, metrics=None, start=0.0, end=None, subtitles_start=None):
+    """
+    Burn the subtitles into the video. metrics - Metrics the ffmpeg run is timed into.
+    start, end - only this time range (seconds) of input is decoded and written (end=None -> to the end)
+    subtitles_start - time in the subtitles the output starts at (default start, for subtitles timed to input -
+                      pass 0 if input was already cut from the video they are timed to)
+    """
+    metrics = metrics or Metrics(progress=None)
+    offset = start if subtitles_start is None else subtitles_start
+    # Shifting the timestamps loses the frame rate, so it is set again on the output
+    output_args = {'r': probe_video(input).fps} if offset else {}
+    with metrics.time("burn_subtitles"):
+        (
+            ffmpeg.input(input, **range_args(start, end))
+            .output(output, vf=subtitle_filter(subtitles, offset), acodec='copy', **output_args)
+            .global_args('-y')
+            .run()
+        )
+
+def combine_video_audio(video_input, audio_input, output, metrics=None, start=0.0, end=None, audio_start=None):
+    """
+    Mux the audio into the video. metrics - Metrics the ffmpeg run is timed into.
+    start, end - only this time range (seconds) of video_input is written (end=None -> to the end). Cutting at start
+                 re-encodes the video, since copied video can only start on a keyframe.
+    audio_start - time in audio_input the output starts at (default start, for audio that lines up with video_input)
+    """
+    metrics = metrics or Metrics(progress=None)
+    video = ffmpeg.input(video_input, **range_args(start, end))
+    audio = ffmpeg.input(audio_input, **range_args(start if audio_start is None else audio_start))
+    video_args = {'vcodec': 'libx264', 'crf': 18} if start else {'vcodec': 'copy'}
+
+    with metrics.time("combine_video_audio"):
+        ffmpeg.output(video.video, audio.audio, output, acodec='aac', shortest=None, **video_args).global_args('-y').run()
     
 
 # IMPLEMENTATION -------------------------
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import ffmpeg
+import torch
+
+"""
+Self-contained benchmarks - every input (videos, transcripts) is generated, so nothing has to be on disk first.
+
+    matting - fps of the full matte + composite pipeline (decode -> model -> composite -> encode) at 480p/720p/1080p
+              for both variants and every refiner, with random weights (same speed as the pretrained ones)
+    subtitles - make_ass (JSON and columnar transcripts) and flicker_text on a large transcript
+    split - split_segments on a long word list (JSON-style dicts and a columnar transcript), and a sweep of 10 max_gap values
+
+Results are written as JSON. Given a baseline file (an earlier results file), every benchmark present in both is
+compared and the run fails if any got worse by more than the threshold.
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline results.json --threshold 0.1
+"""
+
+RESOLUTIONS = {"480p": (854, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+VARIANTS = ["mobilenetv3", "resnet50"]
+REFINERS = ["deep_guided_filter", "fast_guided_filter", "fast_guided_filter_integral"]
+GROUPS = ["matting", "subtitles", "split"]
+
+WORDS = ["never", "give", "up,", "keep", "pushing", "through", "the", "pain", "we", "rise!", "again", "and",
+         "again.", "stronger", "every", "day", "don't", "stop", "now", "fire", "inside", "my", "heart"]
+
+# INPUTS -------------------------
+def make_video(path, size, frames, fps=30, source="testsrc2"):
+    """Write a synthetic clip of frames frames from one of ffmpeg's test sources."""
+    width, height = size
+    (
+        ffmpeg.input(f"{source}=size={width}x{height}:rate={fps}", f="lavfi")
+        .output(path, vframes=frames, vcodec="libx264", pix_fmt="yuv420p", preset="ultrafast")
+        .global_args("-y", "-loglevel", "error")
+        .run()
+    )
+    return path
+
+def make_transcript(word_count, seed=0, words_per_segment=12):
+    """Whisper-style result with word timestamps - random words, durations (some long enough to flicker) and gaps."""
+    rng = random.Random(seed)
+    segments = []
+    t = 0.0
+    for start in range(0, word_count, words_per_segment):
+        words = []
+        for _ in range(min(words_per_segment, word_count - start)):
+            t += rng.choice([0.0, 0.05, 0.1, 0.3, 0.6])
+            duration = rng.choice([0.15, 0.25, 0.4, 0.8, 1.5])
+            words.append({"word": " " + rng.choice(WORDS), "start": round(t, 2), "end": round(t + duration, 2),
+                          "probability": round(rng.random(), 3)})
+            t += duration
+        segments.append({"id": len(segments), "start": words[0]["start"], "end": words[-1]["end"],
+                         "text": "".join(w["word"] for w in words), "words": words})
+    return {"text": " ".join(s["text"] for s in segments), "segments": segments, "language": "en"}
+
+# BENCHMARKS -------------------------
+def best_time(fn, repeat):
+    """Fastest of repeat runs of fn() in seconds (the least disturbed by other processes)."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def bench_matting(work_dir, resolutions, frames, variants=VARIANTS, refiners=REFINERS, downsample_ratio=0.8):
+    """fps of matting + compositing synthetic clips, timed from the first output frame to the last (so model loading isn't counted)."""
+    from remove_bg import matte_video, composite_video, frame_buffers
+    from video_io import FFmpegReader
+    from metrics import Metrics
+
+    results = {}
+    for resolution in resolutions:
+        size = RESOLUTIONS[resolution]
+        fg = make_video(os.path.join(work_dir, f"fg_{resolution}.mp4"), size, frames)
+        bg = make_video(os.path.join(work_dir, f"bg_{resolution}.mp4"), size, frames, source="smptebars")
+
+        for variant in variants:
+            for refiner in refiners:
+                reader_fg = FFmpegReader(fg, buffers=frame_buffers(8, 1))
+                reader_bg = FFmpegReader(bg, buffers=frame_buffers(8, 1))
+                written = []
+                metrics = Metrics(progress=None)
+                try:
+                    mattes = matte_video(fg, reader_fg, None, variant, refiner, downsample_ratio, metrics=metrics)
+                    composite_video(mattes, reader_bg, lambda frame: written.append(time.perf_counter()),
+                                    reader_fg.frame_count, metrics=metrics)
+                finally:
+                    reader_fg.release()
+                    reader_bg.release()
+
+                fps = (len(written) - 1) / (written[-1] - written[0]) if len(written) > 1 else 0.0
+                inference = metrics.summary()["stages"]["inference"]["mean_ms"]
+                results[f"matting/{resolution}/{variant}/{refiner}"] = {"value": fps, "unit": "fps", "higher_is_better": True}
+                print(f"matting {resolution} {variant} {refiner}: {fps:.2f} fps (inference {inference:.1f} ms/frame)")
+    return results
+
+def bench_subtitles(work_dir, word_count, repeat):
+    from add_lyrics import make_ass, flicker_text
+    from transcript_format import ColumnarTranscript
+
+    transcript = make_transcript(word_count)
+    json_path = os.path.join(work_dir, "transcript.json")
+    with open(json_path, "w") as f:
+        json.dump(transcript, f)
+    columnar_path = os.path.join(work_dir, "transcript.wtab")
+    ColumnarTranscript.from_result(transcript).save(columnar_path)
+    ass_path = os.path.join(work_dir, "subtitles.ass")
+
+    words = [w for s in transcript["segments"] for w in s["words"]]
+    styles = ["Default", "Default-Red", "Fancy", "Fancy-Red"]
+    def run_flicker():
+        subtitles = []
+        for w in words:
+            flicker_text(w["start"], w["end"], w["word"].strip(), subtitles, styles)
+
+    results = {
+        f"subtitles/make_ass/{word_count}": best_time(lambda: make_ass(json_path, ass_path), repeat),
+        f"subtitles/make_ass_columnar/{word_count}": best_time(lambda: make_ass(columnar_path, ass_path), repeat),
+        f"subtitles/flicker_text/{word_count}": best_time(run_flicker, repeat),
+    }
+    for name, seconds in results.items():
+        print(f"{name}: {seconds * 1000:.1f} ms")
+    return {name: {"value": seconds, "unit": "s", "higher_is_better": False} for name, seconds in results.items()}
+
+def bench_split(word_count, repeat):
+    from transcribe import split_segments, sweep_split_segments
+    from transcript_format import ColumnarTranscript
+
+    transcript = make_transcript(word_count)
+    columnar = ColumnarTranscript.from_result(transcript)
+    max_gaps = [0.05 * i for i in range(1, 11)]
+    results = {
+        f"split/split_segments/{word_count}": best_time(lambda: split_segments(transcript), repeat),
+        f"split/split_segments_columnar/{word_count}": best_time(lambda: split_segments(columnar), repeat),
+        f"split/sweep_split_segments/{word_count}": best_time(lambda: sweep_split_segments(transcript, max_gaps), repeat),
+    }
+    for name, seconds in results.items():
+        print(f"{name}: {seconds * 1000:.1f} ms")
+    return {name: {"value": seconds, "unit": "s", "higher_is_better": False} for name, seconds in results.items()}
+
+# RESULTS -------------------------
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare results against baseline (both {name: {"value", "higher_is_better", ...}}).
+    Returns the names of benchmarks that got worse by more than threshold (a fraction, 0.1 = 10%).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or not baseline[name]["value"]:
+            continue
+        old, new = baseline[name]["value"], result["value"]
+        # Positive = better
+        change = (new - old) / old if result["higher_is_better"] else (old - new) / old
+        status = "REGRESSION" if change < -threshold else "ok"
+        if status == "REGRESSION":
+            regressions.append(name)
+        print(f"{status:<10} {name}: {old:.4g} -> {new:.4g} {result['unit']} ({change:+.1%})")
+    return regressions
+
+def run(groups=GROUPS, resolutions=RESOLUTIONS, frames=30, variants=VARIANTS, refiners=REFINERS,
+        word_count=20000, repeat=3, output="benchmark_results.json", baseline=None, threshold=0.1):
+    """
+    Run the benchmark groups, save the results to output and compare them against the baseline file if given.
+    Returns the regressed benchmark names (empty without a baseline).
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        if "matting" in groups:
+            results.update(bench_matting(work_dir, resolutions, frames, variants, refiners))
+        if "subtitles" in groups:
+            results.update(bench_subtitles(work_dir, word_count, repeat))
+        if "split" in groups:
+            results.update(bench_split(word_count * 5, repeat))
+
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"Saved benchmark results to: {output}")
+
+    if baseline is None:
+        return []
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f)["results"], threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}")
+    return regressions
+
+# IMPLEMENTATION -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument("--groups", default=",".join(GROUPS), help="comma separated: " + ", ".join(GROUPS))
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS), help="comma separated: " + ", ".join(RESOLUTIONS))
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--refiners", default=",".join(REFINERS))
+    parser.add_argument("--frames", type=int, default=30, help="frames per matting clip")
+    parser.add_argument("--words", type=int, default=20000, help="words in the subtitle transcript (split uses 5x)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown as a fraction (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    regressions = run(args.groups.split(","), args.resolutions.split(","), args.frames, args.variants.split(","),
+                      args.refiners.split(","), args.words, args.repeat, args.output, args.baseline, args.threshold)
+    raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,93 @@
+import numpy as np
+import torch
+
+"""
+Preallocated frame buffers for the per-frame loop, so frames of the same size reuse the same memory
+instead of allocating new frame-sized arrays and tensors every time.
+
+Buffers are handed out in turn from a fixed ring, so a buffer is only valid until the ring comes back
+around to it - the ring has to be larger than the number of frames still in use downstream (sitting in
+queues, being composited or encoded). Buffers are reallocated only when the frame size changes.
+"""
+
+class BufferRing:
+    """
+    count - number of buffers to cycle through
+    dtype - numpy dtype of the buffers
+    """
+    def __init__(self, count, dtype=np.uint8):
+        self.count = max(count, 1)
+        self.dtype = dtype
+        self.shape = None
+        self._buffers = []
+        self._index = 0
+
+    def next(self, shape):
+        """Return the next buffer of the given shape (contents are left over from earlier use)."""
+        shape = tuple(shape)
+        if shape != self.shape:
+            self.shape = shape
+            self._buffers = [np.empty(shape, dtype=self.dtype) for _ in range(self.count)]
+        buffer = self._buffers[self._index % self.count]
+        self._index += 1
+        return buffer
+
+class MattingBuffers:
+    """
+    Input tensor and output arrays for run_model.
+    in_use - number of output frames that can still be in use downstream when the next chunk is stored
+             (None = allocate new outputs every chunk, for callers that keep the outputs around)
+    """
+    def __init__(self, in_use=None, device="cpu"):
+        self.in_use = in_use
+        self.device = device
+        self._src = None
+        self._fgr = None
+        self._alpha = None
+        self._size = None
+        self._chunk = 0
+
+    def load(self, frames):
+        """Copy a list of T BGR uint8 frames into the [1, T, C, H, W] RGB 0-1 input tensor and return it."""
+        t = len(frames)
+        height, width = frames[0].shape[:2]
+        if self._src is None or self._src.shape[1] < t or self._src.shape[3:] != (height, width):
+            self._src = torch.empty((1, t, 3, height, width), dtype=torch.float32, device=self.device)
+
+        # BGR -> RGB and hwc -> chw in the same copy, one channel at a time (converting to float on the way)
+        src = self._src[:, :t]
+        for i, frame in enumerate(frames):
+            frame = torch.from_numpy(frame)
+            for c in range(3):
+                src[0, i, c].copy_(frame[:, :, 2 - c])
+        return src.div_(255.0)
+
+    def outputs(self, t, height, width):
+        """Return the next (fgr (T, H, W, 3), alpha (T, H, W)) uint8 output arrays."""
+        if self.in_use is None:
+            return np.empty((t, height, width, 3), dtype=np.uint8), np.empty((t, height, width), dtype=np.uint8)
+
+        # Enough chunk-sized slots for the frames in use downstream plus the chunk being stored
+        if self._fgr is None or self._size != (height, width) or t > self._chunk:
+            self._size, self._chunk = (height, width), t
+            slots = -(-self.in_use // t) + 1
+            self._fgr, self._alpha = BufferRing(slots), BufferRing(slots)
+        fgr = self._fgr.next((self._chunk, height, width, 3))
+        alpha = self._alpha.next((self._chunk, height, width))
+        return fgr[:t], alpha[:t]
+
+    def store(self, fgr, alpha):
+        """
+        Convert the model's fgr [1, T, 3, H, W] and alpha [1, T, 1, H, W] (0-1 floats) into the next uint8 output
+        arrays and return them. fgr and alpha are scaled in place.
+        """
+        t, _, height, width = fgr.shape[1:]
+        fgr_np, alpha_np = self.outputs(t, height, width)
+
+        # chw -> hwc one channel at a time, truncating to uint8 on the way (same as astype)
+        fgr_out = torch.from_numpy(fgr_np)
+        fgr = fgr[0].mul_(255)
+        for c in range(3):
+            fgr_out[..., c].copy_(fgr[:, c])
+        torch.from_numpy(alpha_np).copy_(alpha[0, :, 0].mul_(255))
+        return fgr_np, alpha_np
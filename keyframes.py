@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+"""
+Keyframe matting - when the shot barely changes, run the network only on keyframes and carry the alpha over
+to the frames in between by warping it along the optical flow.
+
+Motion is estimated with Farneback optical flow on small grayscale copies of the frames, always from the
+current frame back to the last keyframe (so errors don't pile up from frame to frame). A frame becomes a new
+keyframe when:
+    - it differs too much from the keyframe (scene change, big movement)
+    - the keyframe warped onto it doesn't match it around the person (the flow can't explain the motion)
+    - the last keyframe was max_interval frames ago
+Propagated frames use the frame itself as the foreground colour.
+"""
+
+class KeyframePropagator:
+    """
+    diff_threshold - mean grayscale difference (0-255) to the keyframe above which the model runs again
+    error_threshold - mean grayscale error (0-255) of the warped keyframe around the person above which the model runs again
+    max_interval - run the model at least every this many frames
+    flow_scale - size of the frames the flow is estimated on, relative to the video
+    alpha_threshold - alpha values (0-255) above this count as part of the person
+    """
+    def __init__(self, diff_threshold=12, error_threshold=6, max_interval=4, flow_scale=0.25, alpha_threshold=16):
+        self.diff_threshold = diff_threshold
+        self.error_threshold = error_threshold
+        self.max_interval = max_interval
+        self.flow_scale = flow_scale
+        self.alpha_threshold = alpha_threshold
+        self.keyframes = 0
+        self.propagated = 0
+        self._key_gray = None
+        self._key_alpha = None
+        self._key_mask = None
+        self._since_key = 0
+        self._grids = {}
+        self._map = None
+
+    def _small_gray(self, frame):
+        height, width = frame.shape[:2]
+        size = (max(int(width * self.flow_scale), 16), max(int(height * self.flow_scale), 16))
+        return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+
+    def _coordinates(self, height, width):
+        """Pixel coordinate grids (x, y) as float32, kept between frames of the same size."""
+        if (height, width) not in self._grids:
+            self._grids[height, width] = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        return self._grids[height, width]
+
+    def check(self, frame):
+        """
+        Whether frame can be propagated from the last keyframe (False = run the model and call set_keyframe).
+        When True, the warp for warp() is ready.
+        """
+        # The keyframe itself counts, so at most max_interval - 1 frames are propagated from it
+        if self._key_gray is None or self._since_key >= self.max_interval - 1:
+            return False
+
+        gray = self._small_gray(frame)
+        if np.abs(gray.astype(np.int16) - self._key_gray).mean() > self.diff_threshold:
+            return False
+
+        # Flow from this frame back to the keyframe - for every pixel here, where it was in the keyframe
+        flow = cv2.calcOpticalFlowFarneback(gray, self._key_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        grid_x, grid_y = self._coordinates(*gray.shape)
+        warped = cv2.remap(self._key_gray, grid_x + flow[..., 0], grid_y + flow[..., 1], cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_REPLICATE)
+        mask = cv2.remap(self._key_mask, grid_x + flow[..., 0], grid_y + flow[..., 1], cv2.INTER_NEAREST)
+        error = np.abs(warped.astype(np.int16) - gray)
+        error = error[mask > 0].mean() if mask.any() else error.mean()
+        if error > self.error_threshold:
+            return False
+
+        # Full resolution sampling map for warp()
+        height, width = frame.shape[:2]
+        flow = cv2.resize(flow, (width, height), interpolation=cv2.INTER_LINEAR)
+        flow[..., 0] *= width / gray.shape[1]
+        flow[..., 1] *= height / gray.shape[0]
+        grid_x, grid_y = self._coordinates(height, width)
+        flow[..., 0] += grid_x
+        flow[..., 1] += grid_y
+        self._map = flow
+        return True
+
+    def warp(self, frame, fgr_out, alpha_out):
+        """Write the propagated fgr (RGB) and alpha of frame into fgr_out and alpha_out (after check() returned True)."""
+        cv2.remap(self._key_alpha, self._map, None, cv2.INTER_LINEAR, dst=alpha_out, borderMode=cv2.BORDER_REPLICATE)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=fgr_out)
+        self._since_key += 1
+        self.propagated += 1
+
+    def set_keyframe(self, frame, alpha):
+        """Make frame (with its model alpha) the keyframe the next frames are propagated from."""
+        self._key_gray = self._small_gray(frame)
+        self._key_alpha = alpha.copy()
+        # Area around the person where the propagation error is measured
+        small = cv2.resize(alpha, self._key_gray.shape[::-1], interpolation=cv2.INTER_AREA)
+        self._key_mask = cv2.dilate((small > self.alpha_threshold).astype(np.uint8), np.ones((5, 5), np.uint8))
+        self._since_key = 0
+        self.keyframes += 1
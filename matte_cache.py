@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+
+"""
+On-disk cache of the raw MattingNetwork outputs, so re-compositing a clip (new subtitles, new background)
+doesn't need another matting pass.
+
+Each entry is a directory of fixed-size chunks, memory-mapped when read back:
+    <cache_dir>/<key>/meta.json
+    <cache_dir>/<key>/fgr_00000.npy - (N, H, W, 3) uint8, RGB
+    <cache_dir>/<key>/alpha_00000.npy - (N, H, W) uint8
+Entries are only visible once complete (written to a temp dir, then renamed), and the least recently
+used ones are evicted once the cache grows past max_bytes.
+"""
+
+def file_hash(path, block_size=1 << 20):
+    """sha256 of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def matte_cache_key(input_video, **settings):
+    """Cache key covering the video's contents and every model setting that changes the mattes."""
+    payload = json.dumps({"input": file_hash(input_video), **settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+def _dir_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+class MatteCache:
+    """
+    cache_dir - where entries are stored
+    max_bytes - total size the cache is trimmed back to after each new entry
+    chunk_frames - frames per chunk file
+    """
+    def __init__(self, cache_dir="cache/mattes", max_bytes=20 * 1024 ** 3, chunk_frames=32):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.chunk_frames = chunk_frames
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """Return the CachedMattes stored under key, or None."""
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # Mark as recently used for eviction
+        os.utime(meta_path)
+        return CachedMattes(entry_dir, meta)
+
+    def new_entry_dir(self):
+        """Create the temp dir a new entry is written into before commit_entry makes it visible."""
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        return tmp_dir
+
+    def commit_entry(self, key, tmp_dir, frame_count, chunk_count):
+        """Store the chunks written into tmp_dir under key."""
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({"frame_count": frame_count, "chunk_count": chunk_count}, f)
+
+        try:
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError:
+            # Another run already stored the same entry
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    def record(self, key, mattes):
+        """
+        Pass (fgr, alpha) pairs from mattes through while saving them under key.
+        The entry is only kept if mattes runs to the end - a partial clip is thrown away.
+        """
+        writer = MatteWriter(self, key)
+        try:
+            for fgr, alpha in mattes:
+                writer.add(fgr, alpha)
+                yield fgr, alpha
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            meta_path = os.path.join(entry.path, "meta.json")
+            if entry.is_dir() and os.path.exists(meta_path):
+                entries.append((os.path.getmtime(meta_path), entry.name, _dir_size(entry.path)))
+
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+            total -= size
+
+class CachedMattes:
+    """Iterates the (fgr, alpha) pairs of a cache entry, reading the chunks as memory maps."""
+    def __init__(self, entry_dir, meta):
+        self.entry_dir = entry_dir
+        self.frame_count = meta["frame_count"]
+        self.chunk_count = meta["chunk_count"]
+
+    def __len__(self):
+        return self.frame_count
+
+    def __iter__(self):
+        for i in range(self.chunk_count):
+            fgr = np.load(os.path.join(self.entry_dir, f"fgr_{i:05}.npy"), mmap_mode="r")
+            alpha = np.load(os.path.join(self.entry_dir, f"alpha_{i:05}.npy"), mmap_mode="r")
+            yield from zip(fgr, alpha)
+
+class MatteWriter:
+    """
+    Writes (fgr, alpha) pairs into a new cache entry, one memory-mapped chunk at a time.
+    Several writers can fill one entry in parallel (see new_entry_dir/commit_entry) - each one starts at its
+    own first_chunk and calls finish() instead of commit().
+    """
+    def __init__(self, cache, key, tmp_dir=None, first_chunk=0):
+        self.cache = cache
+        self.key = key
+        self.tmp_dir = tmp_dir or cache.new_entry_dir()
+        self.frame_count = 0
+        self.chunk_count = first_chunk
+        self._fgr = None
+        self._alpha = None
+        self._filled = 0
+
+    def _chunk_paths(self, i):
+        return (os.path.join(self.tmp_dir, f"fgr_{i:05}.npy"),
+                os.path.join(self.tmp_dir, f"alpha_{i:05}.npy"))
+
+    def _start_chunk(self, fgr, alpha):
+        fgr_path, alpha_path = self._chunk_paths(self.chunk_count)
+        n = self.cache.chunk_frames
+        self._fgr = np.lib.format.open_memmap(fgr_path, mode="w+", dtype=np.uint8, shape=(n, *fgr.shape))
+        self._alpha = np.lib.format.open_memmap(alpha_path, mode="w+", dtype=np.uint8, shape=(n, *alpha.shape))
+        self._filled = 0
+        self.chunk_count += 1
+
+    def _finish_chunk(self):
+        n = self._filled
+        fgr, alpha = self._fgr, self._alpha
+        self._fgr = self._alpha = None
+        fgr.flush()
+        alpha.flush()
+
+        # Shrink the last chunk down to the frames actually written
+        if n < len(fgr):
+            fgr_path, alpha_path = self._chunk_paths(self.chunk_count - 1)
+            fgr_part, alpha_part = np.array(fgr[:n]), np.array(alpha[:n])
+            del fgr, alpha
+            np.save(fgr_path, fgr_part)
+            np.save(alpha_path, alpha_part)
+
+    def add(self, fgr, alpha):
+        if self._fgr is None:
+            self._start_chunk(fgr, alpha)
+        self._fgr[self._filled] = fgr
+        self._alpha[self._filled] = alpha
+        self._filled += 1
+        self.frame_count += 1
+        if self._filled == self.cache.chunk_frames:
+            self._finish_chunk()
+
+    def finish(self):
+        """Flush the last chunk."""
+        if self._fgr is not None:
+            self._finish_chunk()
+
+    def commit(self):
+        self.finish()
+        self.cache.commit_entry(self.key, self.tmp_dir, self.frame_count, self.chunk_count)
+
+    def abort(self):
+        self._fgr = self._alpha = None
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
@@ -0,0 +1,206 @@
+import bisect
+import json
+import resource
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+"""
+Per-stage timing and throughput for a render.
+
+Every stage (decode, inference, composite, encode, the ffmpeg steps, ...) records how long each call took
+into a fixed-bucket latency histogram, so memory stays constant however long the video is. Finished frames
+feed a rolling fps, and a progress callback is called at most once every progress_interval seconds
+instead of printing on every frame.
+
+At the end of a run the numbers can be printed (report), or exported as JSON or in the Prometheus text format.
+"""
+
+# Histogram bucket upper bounds in seconds (0.1 ms - 10 s, roughly 1-2-5 steps)
+BUCKETS = [0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0]
+
+def peak_rss_mb(children=False):
+    """Peak resident memory (MB) of this process, or of its largest finished child process (workers, ffmpeg)."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in KB on Linux
+    return usage.ru_maxrss / 1024
+
+def print_progress(frames, total, fps):
+    print(f"Processing frame {frames}/{total} ({fps:.1f} fps)")
+
+class Histogram:
+    """Latency histogram with fixed buckets (last bucket catches everything above BUCKETS[-1])."""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate of the q quantile (0-1), interpolated inside the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                estimate = low + (high - low) * (rank - seen) / n
+                return min(max(estimate, self.min), self.max)
+            seen += n
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "min_ms": self.min * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+class Metrics:
+    """
+    total - number of frames expected (for progress)
+    progress - called as progress(frames, total, fps) at most every progress_interval seconds (None = no progress)
+    fps_window - seconds of finished frames the rolling fps is measured over
+    Safe to record into from several threads.
+    """
+    def __init__(self, total=0, progress=print_progress, progress_interval=1.0, fps_window=5.0):
+        self.total = total
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.fps_window = fps_window
+        self.stages = {}
+        self.frames = 0
+        self.min_fps = None
+        self.start = time.perf_counter()
+        self._recent = deque()
+        self._last_progress = self.start
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """Record one call of stage that took seconds."""
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """Time the body of a with block as one call of stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage, iterable):
+        """Pass the items of iterable through, timing how long producing each one took as stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def fps(self):
+        """Frames per second over the last fps_window seconds."""
+        with self._lock:
+            return self._rolling_fps()
+
+    def _rolling_fps(self):
+        if len(self._recent) < 2 or self._recent[-1] == self._recent[0]:
+            return 0.0
+        return (len(self._recent) - 1) / (self._recent[-1] - self._recent[0])
+
+    def frame_done(self):
+        """Count a finished frame."""
+        now = time.perf_counter()
+        with self._lock:
+            self.frames += 1
+            self._recent.append(now)
+            while now - self._recent[0] > self.fps_window:
+                self._recent.popleft()
+            if now - self._last_progress < self.progress_interval:
+                return
+            self._last_progress = now
+            fps = self._rolling_fps()
+            # Only count windows that are full, the first frames of a run are always slow
+            if now - self.start >= self.fps_window:
+                self.min_fps = fps if self.min_fps is None else min(self.min_fps, fps)
+            frames = self.frames
+        if self.progress is not None:
+            self.progress(frames, self.total, fps)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "elapsed_s": elapsed,
+                "fps": self.frames / elapsed if elapsed else 0.0,
+                "rolling_fps": self._rolling_fps(),
+                "min_rolling_fps": self.min_fps,
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_child_rss_mb": peak_rss_mb(children=True),
+                "stages": {name: histogram.summary() for name, histogram in self.stages.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self, prefix="render"):
+        """The metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            f"# TYPE {prefix}_frames_total counter",
+            f"{prefix}_frames_total {summary['frames']}",
+            f"# TYPE {prefix}_fps gauge",
+            f"{prefix}_fps {summary['fps']}",
+            f"# TYPE {prefix}_peak_rss_bytes gauge",
+            f"{prefix}_peak_rss_bytes {int(summary['peak_rss_mb'] * 1024 * 1024)}",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for name, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, n in zip(histogram.buckets + [float("inf")], histogram.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {histogram.total}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """Write the metrics to path - Prometheus text for .prom files, JSON otherwise."""
+        with open(path, "w") as f:
+            f.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+
+    def report(self):
+        """Print a per-stage summary."""
+        summary = self.summary()
+        print(f"{summary['frames']} frames in {summary['elapsed_s']:.1f}s ({summary['fps']:.1f} fps), "
+              f"peak memory {summary['peak_rss_mb']:.0f} MB (largest child process: {summary['peak_child_rss_mb']:.0f} MB)")
+        for name, stage in summary["stages"].items():
+            print(f"  {name}: {stage['count']} calls, mean {stage['mean_ms']:.1f} ms, "
+                  f"p95 {stage['p95_ms']:.1f} ms, max {stage['max_ms']:.1f} ms")
@@ -166,6 +166,8 @@ class ConvGRU(nn.Module):
         )
         
     def forward_single_frame(self, x, h):
+        # Lets exported graphs (which can't take None) start from zeros of shape [1, 1, 1, 1]
+        h = h.expand_as(x)
         r, z = self.ih(torch.cat([x, h], dim=1)).split(self.channels, dim=1)
         c = self.hh(torch.cat([x, r * h], dim=1))
         h = (1 - z) * h + z * c
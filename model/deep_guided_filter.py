@@ -21,8 +21,8 @@ class DeepGuidedFilterRefiner(nn.Module):
             nn.Conv2d(hid_channels, 4, kernel_size=1, bias=True)
         )
         
-    def forward_single_frame(self, fine_src, base_src, base_fgr, base_pha, base_hid):
-        fine_x = torch.cat([fine_src, fine_src.mean(1, keepdim=True)], dim=1)
+    def coefficients(self, base_src, base_fgr, base_pha, base_hid):
+        """Low resolution A and b of the guided filter - the refined output is upsample(A) * fine_x + upsample(b)."""
         base_x = torch.cat([base_src, base_src.mean(1, keepdim=True)], dim=1)
         base_y = torch.cat([base_fgr, base_pha], dim=1)
         
@@ -33,6 +33,11 @@ class DeepGuidedFilterRefiner(nn.Module):
         
         A = self.conv(torch.cat([cov_xy, var_x, base_hid], dim=1))
         b = mean_y - A * mean_x
+        return A, b
+
+    def forward_single_frame(self, fine_src, base_src, base_fgr, base_pha, base_hid):
+        fine_x = torch.cat([fine_src, fine_src.mean(1, keepdim=True)], dim=1)
+        A, b = self.coefficients(base_src, base_fgr, base_pha, base_hid)
         
         H, W = fine_src.shape[2:]
         A = F.interpolate(A, (H, W), mode='bilinear', align_corners=False)
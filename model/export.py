@@ -0,0 +1,218 @@
+import copy
+import json
+import numpy as np
+import torch
+from torch import Tensor
+from torch import nn
+from torch.nn import functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from typing import Optional
+
+"""
+Inference-only exports of MattingNetwork.
+
+fold_batchnorm() merges every BatchNorm2d into the conv in front of it, which removes a full pass over
+the activations after almost every conv. export_torchscript() saves a frozen TorchScript graph and
+export_onnx() an ONNX graph, both of which can be loaded without the model code or a state dict.
+"""
+
+# (conv, bn) attribute pairs used by torchvision's ResNet and its Bottleneck blocks
+_NAMED_PAIRS = [('conv1', 'bn1'), ('conv2', 'bn2'), ('conv3', 'bn3')]
+
+def fold_batchnorm(module: nn.Module):
+    """
+    Fold every Conv2d -> BatchNorm2d pair in module (in place) and replace the BatchNorm with Identity.
+    Uses the running statistics, so module must be in eval mode.
+    """
+    if isinstance(module, nn.Sequential):
+        for i in range(len(module) - 1):
+            if isinstance(module[i], nn.Conv2d) and isinstance(module[i + 1], nn.BatchNorm2d):
+                module[i] = fuse_conv_bn_eval(module[i], module[i + 1])
+                module[i + 1] = nn.Identity()
+
+    for conv_name, bn_name in _NAMED_PAIRS:
+        conv = getattr(module, conv_name, None)
+        bn = getattr(module, bn_name, None)
+        if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+            setattr(module, conv_name, fuse_conv_bn_eval(conv, bn))
+            setattr(module, bn_name, nn.Identity())
+
+    for child in module.children():
+        fold_batchnorm(child)
+    return module
+
+
+class _SingleFrame(nn.Module):
+    """Fixes downsample_ratio and makes the recurrent state required, so the model can be traced."""
+    def __init__(self, model: nn.Module, downsample_ratio: float):
+        super().__init__()
+        self.model = model
+        self.downsample_ratio = downsample_ratio
+
+    def forward(self, src: Tensor, r1: Tensor, r2: Tensor, r3: Tensor, r4: Tensor):
+        return tuple(self.model(src, r1, r2, r3, r4, downsample_ratio=self.downsample_ratio))
+
+
+def export_torchscript(model: nn.Module, path: str, downsample_ratio: float, example_size=(512, 288)):
+    """
+    Save model as a frozen TorchScript graph (BatchNorm folded) for single [B, C, H, W] frames.
+    The graph works at any resolution, but downsample_ratio is baked in.
+    example_size - (width, height) of the frame used for tracing
+    """
+    model = copy.deepcopy(model).eval().optimize_for_inference()
+    src = torch.rand(1, 3, example_size[1], example_size[0])
+    rec = [torch.zeros(1, 1, 1, 1)] * 4
+
+    with torch.no_grad():
+        traced = torch.jit.trace(_SingleFrame(model, downsample_ratio).eval(), (src, *rec), check_trace=False)
+        frozen = torch.jit.freeze(traced)
+
+    meta = {
+        'variant': model.variant,
+        'refiner': model.refiner_name,
+        'downsample_ratio': downsample_ratio,
+    }
+    torch.jit.save(frozen, path, _extra_files={'meta.json': json.dumps(meta)})
+
+
+class TorchScriptMatting:
+    """
+    Runs a graph saved by export_torchscript() with the same call signature as MattingNetwork:
+        fgr, pha, *rec = model(src, *rec, downsample_ratio=...)
+    [B, T, C, H, W] time series are run one frame at a time through the single-frame graph.
+    """
+    def __init__(self, path: str, device='cpu'):
+        extra_files = {'meta.json': ''}
+        self.graph = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        # Backend specific rewrites (e.g. mkldnn convs) can't be saved, so they are applied on load
+        self.graph = torch.jit.optimize_for_inference(self.graph)
+        self.meta = json.loads(extra_files['meta.json'])
+        self.downsample_ratio = self.meta['downsample_ratio']
+
+    def __call__(self,
+                 src: Tensor,
+                 r1: Optional[Tensor] = None,
+                 r2: Optional[Tensor] = None,
+                 r3: Optional[Tensor] = None,
+                 r4: Optional[Tensor] = None,
+                 downsample_ratio: float = 1):
+        if downsample_ratio != self.downsample_ratio:
+            raise ValueError(f'Graph was exported for downsample_ratio={self.downsample_ratio}, got {downsample_ratio}')
+
+        zeros = torch.zeros(1, 1, 1, 1, device=src.device, dtype=src.dtype)
+        rec = [zeros if r is None else r for r in (r1, r2, r3, r4)]
+
+        if src.ndim == 4:
+            return list(self.graph(src, *rec))
+
+        fgrs, phas = [], []
+        for src_t in src.unbind(dim=1):
+            fgr, pha, *rec = self.graph(src_t, *rec)
+            fgrs.append(fgr)
+            phas.append(pha)
+        return [torch.stack(fgrs, dim=1), torch.stack(phas, dim=1), *rec]
+
+
+class _ResizeByFactor(torch.autograd.Function):
+    """Bilinear resize by a scale factor that is a graph input (F.interpolate would bake it in as a constant)."""
+    @staticmethod
+    def forward(ctx, x, scale_factor):
+        return F.interpolate(x, scale_factor=float(scale_factor), mode='bilinear',
+                             align_corners=False, recompute_scale_factor=False)
+
+    @staticmethod
+    def symbolic(g, x, scale_factor):
+        scales = g.op('Concat', g.op('Constant', value_t=torch.tensor([1, 1], dtype=torch.float32)),
+                      scale_factor, scale_factor, axis_i=0)
+        return g.op('Resize', x, g.op('Constant', value_t=torch.tensor([], dtype=torch.float32)), scales,
+                    coordinate_transformation_mode_s='pytorch_half_pixel', mode_s='linear', nearest_mode_s='floor')
+
+
+class _OnnxMatting(nn.Module):
+    """MattingNetwork.forward with downsample_ratio as a [1] tensor input. Always runs the refiner."""
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, src: Tensor, r1: Tensor, r2: Tensor, r3: Tensor, r4: Tensor, downsample_ratio: Tensor):
+        model = self.model
+        src_sm = _ResizeByFactor.apply(src, downsample_ratio)
+        f1, f2, f3, f4 = model.backbone(src_sm)
+        f4 = model.aspp(f4)
+        hid, r1, r2, r3, r4 = model.decoder(src_sm, f1, f2, f3, f4, r1, r2, r3, r4)
+        fgr_residual, pha = model.project_mat(hid).split([3, 1], dim=-3)
+        fgr_residual, pha = model.refiner(src, src_sm, fgr_residual, pha, hid)
+        fgr = (fgr_residual + src).clamp(0., 1.)
+        pha = pha.clamp(0., 1.)
+        return fgr, pha, r1, r2, r3, r4
+
+
+def export_onnx(model: nn.Module, path: str, example_size=(512, 288), opset: int = 17):
+    """
+    Save model as an ONNX graph (BatchNorm folded) for single [B, C, H, W] frames, with dynamic resolution.
+        inputs - src, r1i..r4i (start from zeros of shape [1, 1, 1, 1]), downsample_ratio ([1] float32, must be < 1)
+        outputs - fgr, pha, r1o..r4o
+    example_size - (width, height) of the frame used for tracing
+    """
+    model = copy.deepcopy(model).eval().optimize_for_inference()
+    src = torch.rand(1, 3, example_size[1], example_size[0])
+    rec = [torch.zeros(1, 1, 1, 1)] * 4
+    downsample_ratio = torch.tensor([0.5])
+
+    rec_axes = {0: 'batch', 1: 'channels', 2: 'height', 3: 'width'}
+    with torch.no_grad():
+        torch.onnx.export(
+            _OnnxMatting(model).eval(), (src, *rec, downsample_ratio), path,
+            input_names=['src', 'r1i', 'r2i', 'r3i', 'r4i', 'downsample_ratio'],
+            output_names=['fgr', 'pha', 'r1o', 'r2o', 'r3o', 'r4o'],
+            dynamic_axes={
+                'src': {0: 'batch', 2: 'height', 3: 'width'},
+                'fgr': {0: 'batch', 2: 'height', 3: 'width'},
+                'pha': {0: 'batch', 2: 'height', 3: 'width'},
+                **{name: rec_axes for name in ['r1i', 'r2i', 'r3i', 'r4i', 'r1o', 'r2o', 'r3o', 'r4o']},
+            },
+            opset_version=opset,
+            dynamo=False)
+
+
+class OnnxMatting:
+    """
+    Runs a graph saved by export_onnx() on onnxruntime's CPU provider, with the same call signature as MattingNetwork:
+        fgr, pha, *rec = model(src, *rec, downsample_ratio=...)
+    Tensors are handed to onnxruntime as numpy views without copying.
+    [B, T, C, H, W] time series are run one frame at a time through the single-frame graph.
+    """
+    def __init__(self, path: str, num_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads # 0 = one per core
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def _run(self, src: np.ndarray, rec, downsample_ratio: np.ndarray):
+        inputs = {'src': src, 'r1i': rec[0], 'r2i': rec[1], 'r3i': rec[2], 'r4i': rec[3],
+                  'downsample_ratio': downsample_ratio}
+        return self.session.run(None, inputs)
+
+    def __call__(self,
+                 src: Tensor,
+                 r1: Optional[Tensor] = None,
+                 r2: Optional[Tensor] = None,
+                 r3: Optional[Tensor] = None,
+                 r4: Optional[Tensor] = None,
+                 downsample_ratio: float = 1):
+        zeros = np.zeros((1, 1, 1, 1), dtype=np.float32)
+        rec = [zeros if r is None else r.numpy() for r in (r1, r2, r3, r4)]
+        ratio = np.array([downsample_ratio], dtype=np.float32)
+
+        if src.ndim == 4:
+            return [torch.from_numpy(x) for x in self._run(src.contiguous().numpy(), rec, ratio)]
+
+        fgrs, phas = [], []
+        for src_t in src.unbind(dim=1):
+            fgr, pha, *rec = self._run(src_t.contiguous().numpy(), rec, ratio)
+            fgrs.append(fgr)
+            phas.append(pha)
+        return [torch.from_numpy(np.stack(fgrs, axis=1)), torch.from_numpy(np.stack(phas, axis=1)),
+                *[torch.from_numpy(r) for r in rec]]
@@ -10,6 +10,8 @@ from .lraspp import LRASPP
 from .decoder import RecurrentDecoder, Projection
 from .fast_guided_filter import FastGuidedFilterRefiner
 from .deep_guided_filter import DeepGuidedFilterRefiner
+from .export import fold_batchnorm
+from .tiling import refine_tiled
 
 class MattingNetwork(nn.Module):
     def __init__(self,
@@ -18,7 +20,11 @@ class MattingNetwork(nn.Module):
                  pretrained_backbone: bool = False):
         super().__init__()
         assert variant in ['mobilenetv3', 'resnet50']
-        assert refiner in ['fast_guided_filter', 'deep_guided_filter']
+        assert refiner in ['fast_guided_filter', 'fast_guided_filter_integral', 'deep_guided_filter']
+        self.variant = variant
+        self.refiner_name = refiner
+        # When set, the full resolution refiner step runs in tiles of this size (bounded memory, same output)
+        self.tile_size: Optional[int] = None
         
         if variant == 'mobilenetv3':
             self.backbone = MobileNetV3LargeEncoder(pretrained_backbone)
@@ -35,7 +41,8 @@ class MattingNetwork(nn.Module):
         if refiner == 'deep_guided_filter':
             self.refiner = DeepGuidedFilterRefiner()
         else:
-            self.refiner = FastGuidedFilterRefiner()
+            # fast_guided_filter_integral - same filter with the box blur done by IntegralBoxFilter (running sums)
+            self.refiner = FastGuidedFilterRefiner(integral=refiner == 'fast_guided_filter_integral')
         
     def forward(self,
                 src: Tensor,
@@ -57,6 +64,9 @@ class MattingNetwork(nn.Module):
         
         if not segmentation_pass:
             fgr_residual, pha = self.project_mat(hid).split([3, 1], dim=-3)
+            if downsample_ratio != 1 and self.tile_size:
+                fgr, pha = refine_tiled(self.refiner, src, src_sm, fgr_residual, pha, hid, self.tile_size)
+                return [fgr, pha, *rec]
             if downsample_ratio != 1:
                 fgr_residual, pha = self.refiner(src, src_sm, fgr_residual, pha, hid)
             fgr = fgr_residual + src
@@ -67,6 +77,15 @@ class MattingNetwork(nn.Module):
             seg = self.project_seg(hid)
             return [seg, *rec]
 
+    def optimize_for_inference(self):
+        """
+        Fold every BatchNorm into the conv in front of it (in place).
+        The model gives the same outputs but can no longer be trained.
+        """
+        self.eval()
+        fold_batchnorm(self)
+        return self
+
     def _interpolate(self, x: Tensor, scale_factor: float):
         if x.ndim == 5:
             B, T = x.shape[:2]
@@ -0,0 +1,48 @@
+import torch
+from torch import Tensor
+from torch import nn
+from typing import Optional
+
+"""
+Reduced precision / memory format modes for running MattingNetwork on CPU.
+
+    fp32 - unchanged
+    bf16 - bfloat16 autocast
+    channels_last - NHWC memory format, which the CPU conv kernels are fastest with
+
+There is no int8 mode: static quantization of the backbone and LRASPP (FX graph mode, fused conv-bn-relu,
+activations kept in int8 between convs) ran at 1055 ms/frame against 130 ms for fp32 with the x86 engine and
+222 ms with qnnpack, and per-conv quantization was slower still. Dynamic quantization doesn't apply either -
+PyTorch only supports it for Linear/RNN layers, which this network doesn't have.
+"""
+
+PRECISIONS = ['fp32', 'bf16', 'channels_last']
+
+
+class AutocastMatting:
+    """Runs the model under bfloat16 autocast, returning fp32 fgr/pha like the original model."""
+    def __init__(self, model: nn.Module, dtype=torch.bfloat16):
+        self.model = model
+        self.dtype = dtype
+
+    def __call__(self,
+                 src: Tensor,
+                 r1: Optional[Tensor] = None,
+                 r2: Optional[Tensor] = None,
+                 r3: Optional[Tensor] = None,
+                 r4: Optional[Tensor] = None,
+                 downsample_ratio: float = 1):
+        with torch.autocast(src.device.type, dtype=self.dtype):
+            fgr, pha, *rec = self.model(src, r1, r2, r3, r4, downsample_ratio=downsample_ratio)
+        return [fgr.float(), pha.float(), *rec]
+
+
+def apply_precision(model: nn.Module, precision: str):
+    """Return a version of model (same call signature) that runs in the given precision mode."""
+    assert precision in PRECISIONS
+    if precision == 'bf16':
+        return AutocastMatting(model)
+    if precision == 'channels_last':
+        # Convs pick the weight's memory format, so the activations follow along
+        return model.to(memory_format=torch.channels_last)
+    return model
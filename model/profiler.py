@@ -0,0 +1,207 @@
+import time
+import torch
+from torch import Tensor
+from torch import nn
+from torch.utils.flop_counter import FlopCounterMode
+from typing import Dict, List, Optional, Tuple
+
+from .mobilenetv3 import MobileNetV3LargeEncoder
+from .resnet import ResNet50Encoder
+from .lraspp import LRASPP
+from .decoder import RecurrentDecoder, AvgPool, BottleneckBlock, UpsamplingBlock, OutputBlock, ConvGRU, Projection
+from .fast_guided_filter import FastGuidedFilterRefiner
+from .deep_guided_filter import DeepGuidedFilterRefiner
+
+"""
+Opt-in per-module profiling of MattingNetwork.
+
+ModuleProfiler hooks the blocks of the network (backbone, LRASPP, each decoder block and its ConvGRU,
+the projections and the refiner) and records for each one:
+    time - wall time per frame (a parent's time includes its children)
+    flops - FLOPs per frame, counted by torch's FlopCounterMode (convs and matmuls - elementwise ops,
+            pooling and resizing are not counted)
+    output - bytes per frame of the tensors the module returns
+    activations - bytes per frame of every tensor produced by the leaf modules inside it
+Nothing is attached until the profiler is entered, so a normal model runs without any hooks.
+"""
+
+_PROFILED_TYPES = (MobileNetV3LargeEncoder, ResNet50Encoder, LRASPP, RecurrentDecoder, AvgPool, BottleneckBlock,
+                   UpsamplingBlock, OutputBlock, ConvGRU, Projection, FastGuidedFilterRefiner, DeepGuidedFilterRefiner)
+
+
+def _tensor_bytes(output) -> int:
+    if isinstance(output, Tensor):
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)):
+        return sum(_tensor_bytes(o) for o in output)
+    return 0
+
+
+def _frames(args) -> int:
+    """Number of frames (B * T, or B for 4-D input) in the first tensor argument of a module call."""
+    for arg in args:
+        if isinstance(arg, Tensor):
+            return arg.shape[0] * arg.shape[1] if arg.ndim == 5 else arg.shape[0]
+    return 1
+
+
+class ModuleStats:
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.calls = 0
+        self.frames = 0
+        self.seconds = 0.0
+        self.flops = 0
+        self.output_bytes = 0
+        self.activation_bytes = 0
+
+    def per_frame(self) -> dict:
+        frames = max(self.frames, 1)
+        return {
+            'name': self.name,
+            'time_ms': self.seconds / frames * 1000,
+            'flops': self.flops / frames,
+            'output_bytes': self.output_bytes / frames,
+            'activation_bytes': self.activation_bytes / frames,
+        }
+
+
+class ModuleProfiler:
+    """
+    Use as a context manager around forward calls of model:
+        with ModuleProfiler(model) as profiler:
+            model(src, downsample_ratio=0.25)
+        print(profiler.report())
+    count_flops - also count FLOPs (slows the calls down, so don't mix with timing runs you care about)
+    """
+    def __init__(self, model: nn.Module, count_flops: bool = True):
+        self.model = model
+        self.count_flops = count_flops
+        self.stats: Dict[str, ModuleStats] = {}
+        self.total = ModuleStats('total', 0)
+        self._handles = []
+        self._starts: Dict[str, List[float]] = {}
+        self._active: List[str] = []
+        self._flop_counter: Optional[FlopCounterMode] = None
+
+    def _sync(self):
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+    def _pre_hook(self, name: str):
+        def hook(module, args):
+            self._sync()
+            self._starts.setdefault(name, []).append(time.perf_counter())
+            self._active.append(name)
+        return hook
+
+    def _post_hook(self, name: str):
+        def hook(module, args, output):
+            self._sync()
+            stats = self.stats[name]
+            stats.seconds += time.perf_counter() - self._starts[name].pop()
+            stats.calls += 1
+            stats.frames += _frames(args)
+            stats.output_bytes += _tensor_bytes(output)
+            self._active.pop()
+        return hook
+
+    def _leaf_hook(self, module, args, output):
+        # In-place ops (ReLU(True), Identity left by fold_batchnorm) don't produce a new tensor
+        if isinstance(output, Tensor) and any(isinstance(a, Tensor) and a.data_ptr() == output.data_ptr() for a in args):
+            return
+        size = _tensor_bytes(output)
+        for name in self._active:
+            self.stats[name].activation_bytes += size
+        self.total.activation_bytes += size
+
+    def _model_pre_hook(self, module, args):
+        self._sync()
+        self._model_start = time.perf_counter()
+
+    def _model_post_hook(self, module, args, output):
+        self._sync()
+        self.total.seconds += time.perf_counter() - self._model_start
+        self.total.calls += 1
+        self.total.frames += _frames(args)
+        self.total.output_bytes += _tensor_bytes(output)
+
+    def __enter__(self):
+        for name, module in self.model.named_modules():
+            if isinstance(module, _PROFILED_TYPES):
+                depth = sum(1 for parent in self.stats if name.startswith(parent + '.')) + 1
+                self.stats[name] = ModuleStats(name, depth)
+                self._handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+                self._handles.append(module.register_forward_hook(self._post_hook(name)))
+            elif not any(module.children()):
+                self._handles.append(module.register_forward_hook(self._leaf_hook))
+        self._handles.append(self.model.register_forward_pre_hook(self._model_pre_hook))
+        self._handles.append(self.model.register_forward_hook(self._model_post_hook))
+
+        if self.count_flops:
+            self._flop_counter = FlopCounterMode(display=False)
+            self._flop_counter.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if self._flop_counter is not None:
+            self._flop_counter.__exit__(*exc)
+            prefix = type(self.model).__name__
+            counts = self._flop_counter.get_flop_counts()
+            for name, stats in self.stats.items():
+                stats.flops += sum(counts.get(f'{prefix}.{name}', {}).values())
+            self.total.flops += sum(counts.get(prefix, {}).values())
+            self._flop_counter = None
+
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        return False
+
+    def results(self) -> List[dict]:
+        """Per-frame numbers for every hooked module (in model order) followed by the whole model."""
+        return [stats.per_frame() for stats in self.stats.values() if stats.calls] + [self.total.per_frame()]
+
+    def report(self) -> str:
+        """Table of the per-frame numbers, children indented under their parent."""
+        total_ms = self.total.per_frame()['time_ms'] or 1
+        lines = [f"{'module':<34}{'ms':>9}{'%':>7}{'GFLOPs':>9}{'out MB':>9}{'act MB':>9}"]
+        for stats in list(self.stats.values()) + [self.total]:
+            if not stats.calls:
+                continue
+            row = stats.per_frame()
+            name = '  ' * (stats.depth - 1) + stats.name if stats.depth else stats.name
+            lines.append(f"{name:<34}{row['time_ms']:>9.2f}{row['time_ms'] / total_ms * 100:>7.1f}"
+                         f"{row['flops'] / 1e9:>9.2f}{row['output_bytes'] / 2 ** 20:>9.2f}{row['activation_bytes'] / 2 ** 20:>9.2f}")
+        return '\n'.join(lines)
+
+
+def profile_model(model: nn.Module,
+                  size: Tuple[int, int] = (1920, 1080),
+                  downsample_ratio: float = 0.25,
+                  frames: int = 1,
+                  runs: int = 5,
+                  warmup: int = 2,
+                  device: str = 'cpu') -> ModuleProfiler:
+    """
+    Profile model on random [1, frames, 3, H, W] input of the given (width, height).
+    FLOPs are counted on a separate call so they don't distort the timings, which are averaged over runs
+    (after warmup calls that aren't recorded). Each call starts from an empty recurrent state.
+    """
+    width, height = size
+    src = torch.rand((1, frames, 3, height, width), device=device)
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(src, downsample_ratio=downsample_ratio)
+
+        with ModuleProfiler(model, count_flops=True) as flop_profiler:
+            model(src, downsample_ratio=downsample_ratio)
+        with ModuleProfiler(model, count_flops=False) as profiler:
+            for _ in range(runs):
+                model(src, downsample_ratio=downsample_ratio)
+
+    for name, stats in profiler.stats.items():
+        stats.flops = flop_profiler.stats[name].flops * stats.frames // max(flop_profiler.stats[name].frames, 1)
+    profiler.total.flops = flop_profiler.total.flops * runs
+    return profiler
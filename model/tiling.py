@@ -0,0 +1,82 @@
+import torch
+from torch import Tensor
+from torch import nn
+from typing import Tuple
+
+"""
+Tiled full resolution refinement - bounded memory for 4K sources.
+
+Both refiners end with out = upsample(A) * fine_x + upsample(b), where A and b are computed at the low
+resolution the network runs at. Done at once, that step holds several full resolution 4 channel tensors
+(the upsampled A and b, fine_x, out, and the fgr + src temporaries) on top of the input and the outputs.
+
+refine_tiled computes A and b once, then walks the full resolution frame in tile_size x tile_size tiles:
+for every tile only the low resolution rows/columns it needs are bilinearly upsampled, with the same
+sampling positions as F.interpolate(..., mode='bilinear', align_corners=False) over the whole frame. Every
+output pixel therefore gets exactly the value it would get untiled, so tiles don't have to overlap and
+there are no seams to blend. Peak memory beyond the input and the outputs scales with tile_size.
+"""
+
+
+def _sample_positions(start: int, stop: int, size_in: int, size_out: int) -> Tuple[Tensor, Tensor, Tensor]:
+    """Source indices and weights of bilinear (align_corners=False) resizing for output pixels start..stop-1."""
+    scale = size_in / size_out
+    position = ((torch.arange(start, stop, dtype=torch.float32) + 0.5) * scale - 0.5).clamp_(min=0)
+    index0 = position.long().clamp_(max=size_in - 1)
+    index1 = (index0 + 1).clamp_(max=size_in - 1)
+    return index0, index1, position - index0
+
+
+def _upsample_tile(x: Tensor, size: Tuple[int, int], y0: int, y1: int, x0: int, x1: int) -> Tensor:
+    """Rows y0..y1, columns x0..x1 of x [N, C, h, w] bilinearly resized to size (H, W)."""
+    h, w = x.shape[-2:]
+    row0, row1, row_weight = _sample_positions(y0, y1, h, size[0])
+    col0, col1, col_weight = _sample_positions(x0, x1, w, size[1])
+    # Columns first, on only the low resolution rows this tile reads, then rows (whole rows are cheap to gather)
+    top = int(row0[0])
+    x = x[:, :, top:int(row1[-1]) + 1]
+    device = x.device
+    x = torch.lerp(x.index_select(3, col0.to(device)), x.index_select(3, col1.to(device)), col_weight.to(device, x.dtype))
+    return torch.lerp(x.index_select(2, (row0 - top).to(device)), x.index_select(2, (row1 - top).to(device)),
+                      row_weight.to(device, x.dtype)[:, None])
+
+
+def refine_tiled(refiner: nn.Module,
+                 fine_src: Tensor,
+                 base_src: Tensor,
+                 base_fgr_residual: Tensor,
+                 base_pha: Tensor,
+                 base_hid: Tensor,
+                 tile_size: int) -> Tuple[Tensor, Tensor]:
+    """
+    Refined, clamped full resolution fgr and pha - the same as running the refiner and adding src back,
+    but computed tile by tile. Takes [B, T, C, H, W] or [B, C, H, W] inputs like the refiners.
+    """
+    time_series = fine_src.ndim == 5
+    if time_series:
+        B, T = fine_src.shape[:2]
+        fine_src, base_src, base_fgr_residual, base_pha, base_hid = (
+            x.flatten(0, 1) for x in (fine_src, base_src, base_fgr_residual, base_pha, base_hid))
+
+    A, b = refiner.coefficients(base_src, base_fgr_residual, base_pha, base_hid)
+    # Under autocast they can come out in a lower precision than the frame (cheap to convert at low resolution)
+    A, b = A.to(fine_src.dtype), b.to(fine_src.dtype)
+    N, _, H, W = fine_src.shape
+    fgr = fine_src.new_empty((N, 3, H, W))
+    pha = fine_src.new_empty((N, 1, H, W))
+    for y0 in range(0, H, tile_size):
+        y1 = min(y0 + tile_size, H)
+        for x0 in range(0, W, tile_size):
+            x1 = min(x0 + tile_size, W)
+            src = fine_src[:, :, y0:y1, x0:x1]
+            out = _upsample_tile(A, (H, W), y0, y1, x0, x1)
+            out[:, :3].mul_(src)
+            out[:, 3:].mul_(src.mean(1, keepdim=True))
+            out.add_(_upsample_tile(b, (H, W), y0, y1, x0, x1))
+            torch.clamp(out[:, :3].add_(src), 0., 1., out=fgr[:, :, y0:y1, x0:x1])
+            torch.clamp(out[:, 3:], 0., 1., out=pha[:, :, y0:y1, x0:x1])
+
+    if time_series:
+        fgr = fgr.unflatten(0, (B, T))
+        pha = pha.unflatten(0, (B, T))
+    return fgr, pha
@@ -0,0 +1,136 @@
+import queue
+import threading
+
+"""
+Helpers for running the stages of a frame loop on their own threads.
+
+Stages are joined by bounded queues - once a stage is queue_size items ahead of the next one it
+blocks until there is room again (backpressure), so memory stays capped at a few frames per stage.
+Every stage is a single thread, so items come out in the same order they went in.
+A queue_size of 0 runs the stage inline on the calling thread instead.
+"""
+
+_DONE = object()
+_POLL_INTERVAL = 0.1 # seconds between checks for a stopped stage while blocked on a queue
+
+class _Failure:
+    """Carries an exception raised inside a stage over to the thread consuming it."""
+    def __init__(self, error):
+        self.error = error
+
+def _put(q, item, stop):
+    """Put item into q, giving up if stop gets set while the queue is full."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def prefetch(iterable, queue_size=8):
+    """
+    Consume iterable on a background thread (e.g. decoding a video), yielding its items in order.
+    Exceptions raised by the iterable are re-raised in the consuming thread.
+    """
+    if queue_size <= 0:
+        yield from iterable
+        return
+
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(q, item, stop):
+                    return
+            _put(q, _DONE, stop)
+        except BaseException as e:
+            _put(q, _Failure(e), stop)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Also reached when the consumer stops early, so unblock the producer
+        stop.set()
+        thread.join()
+
+class ThreadedSink:
+    """
+    Calls fn on every item put() into it, on a background thread (e.g. encoding frames).
+    Use as a context manager - leaving the block waits for the queued items to be processed.
+    Exceptions raised by fn are re-raised from the next put() or from close().
+    """
+    def __init__(self, fn, queue_size=8):
+        self.fn = fn
+        self.error = None
+        self._stop = threading.Event()
+        self._queue = None
+        self._thread = None
+
+        if queue_size > 0:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._consume, daemon=True)
+            self._thread.start()
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE or self._stop.is_set():
+                return
+            try:
+                self.fn(item)
+            except BaseException as e:
+                self.error = e
+                self._stop.set()
+                return
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, item):
+        """Queue item for processing, blocking while the queue is full."""
+        if self._thread is None:
+            self.fn(item)
+            return
+        _put(self._queue, item, self._stop)
+        self._raise_error()
+
+    def close(self):
+        """Wait for all queued items to be processed."""
+        if self._thread is None:
+            return
+        _put(self._queue, _DONE, self._stop)
+        self._thread.join()
+        self._raise_error()
+
+    def abort(self):
+        """Stop without processing the rest of the queue."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        # Wake the worker up if it is waiting on an empty queue
+        try:
+            self._queue.put_nowait(_DONE)
+        except queue.Full:
+            pass
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
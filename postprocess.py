@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+
+"""
+Alpha clean-up and compositing, run on every frame after the matting network.
+
+Every step is optional. The per-pixel steps (gamma, threshold) are folded into a single 256-entry lookup
+table, so together they cost one pass over the mask. When the mask is thresholded it is binary, so the
+composite is a masked copy (each pixel comes from either the foreground or the background) - no float blending.
+
+Intermediate masks are written into scratch buffers kept between frames, so a processor shouldn't be shared
+between threads.
+"""
+
+# Sharpening kernel for the alpha mask
+SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
+
+class AlphaPostProcessor:
+    """
+    bilateral - (d, sigma_color, sigma_space) of the edge-smoothing bilateral filter, or None
+    sharpen - whether to sharpen the mask after smoothing
+    gamma - contrast adjustment (alpha ** gamma), or None
+    threshold - alpha values above this become fully opaque and the rest fully transparent (hard edges), or None
+    """
+    def __init__(self, bilateral=(9, 75, 75), sharpen=True, gamma=0.8, threshold=200):
+        self.bilateral = bilateral
+        self.sharpen = sharpen
+        self.gamma = gamma
+        self.threshold = threshold
+
+        # Fold the per-pixel steps into lookup tables
+        #   lut - cleaned-up 0-255 alpha
+        #   background_lut - when thresholded, nonzero where the background shows through (mask for the composite)
+        values = np.arange(256, dtype=np.uint8)
+        if gamma is not None:
+            values = (np.power(values.astype(np.float32) / 255.0, gamma) * 255).astype(np.uint8)
+        if threshold is not None:
+            values = (values > threshold).astype(np.uint8) * 255
+        self.lut = values if (gamma is not None or threshold is not None) else None
+        self.background_lut = 255 - values if threshold is not None else None
+        self._scratch = {}
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        """Scratch buffer reused between frames of the same size."""
+        buffer = self._scratch.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._scratch[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def filter(self, alpha):
+        """Run the smoothing/sharpening steps. The result is a scratch buffer, only valid until the next call."""
+        if self.bilateral is not None:
+            d, sigma_color, sigma_space = self.bilateral
+            alpha = cv2.bilateralFilter(alpha, d=d, sigmaColor=sigma_color, sigmaSpace=sigma_space,
+                                        dst=self._buffer("bilateral", alpha.shape))
+        if self.sharpen:
+            alpha = cv2.filter2D(alpha, -1, SHARPEN_KERNEL, dst=self._buffer("sharpen", alpha.shape))
+        return alpha
+
+    def process(self, alpha):
+        """Return the cleaned-up uint8 alpha mask (a new array)."""
+        alpha = self.filter(alpha)
+        if self.lut is not None:
+            return cv2.LUT(alpha, self.lut)
+        # Don't hand out the scratch buffer
+        return alpha.copy()
+
+    def composite(self, fgr, alpha, background, out=None):
+        """
+        Put the model's foreground (RGB) over a BGR background frame using the cleaned-up alpha.
+        Returns the BGR frame, written into out if given (otherwise a new array).
+        """
+        return self.blend(fgr, self.filter(alpha), background, out)
+
+    def blend(self, fgr, alpha, background, out=None):
+        """Second half of composite - the per-pixel steps and the blend, for an alpha that already went through filter."""
+        if out is None:
+            out = np.empty_like(background)
+
+        # Hard edges - start from the foreground and copy the background in where it shows through
+        if self.background_lut is not None:
+            cv2.cvtColor(fgr, cv2.COLOR_RGB2BGR, dst=out)
+            cv2.copyTo(background, cv2.LUT(alpha, self.background_lut, dst=self._buffer("mask", alpha.shape)), out)
+            return out
+
+        # Soft edges - integer blend, (fgr * alpha + background * (255 - alpha) + 127) // 255
+        if self.lut is not None:
+            alpha = cv2.LUT(alpha, self.lut, dst=self._buffer("lut", alpha.shape))
+        shape = background.shape
+        alpha16 = self._buffer("alpha16", (*alpha.shape, 1), np.uint16)
+        inverse16 = self._buffer("inverse16", (*alpha.shape, 1), np.uint16)
+        blended = self._buffer("blended", shape, np.uint16)
+        scratch = self._buffer("blend_scratch", shape, np.uint16)
+        np.copyto(alpha16, alpha[:, :, np.newaxis])
+        np.subtract(255, alpha16, out=inverse16)
+        np.multiply(fgr[:, :, ::-1], alpha16, out=blended)
+        np.multiply(background, inverse16, out=scratch)
+        blended += scratch
+        blended += 127
+        blended //= 255
+        np.copyto(out, blended, casting="unsafe")
+        return out
@@ -1,109 +1,518 @@
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 import torch
-import cv2
 import numpy as np
 from model import MattingNetwork
+from model.export import export_torchscript, export_onnx, TorchScriptMatting, OnnxMatting
+from model.precision import apply_precision
+from model.profiler import profile_model
+from pipeline import prefetch, ThreadedSink
+from matte_cache import MatteCache, MatteWriter, matte_cache_key, file_hash
+from roi import RoiTracker
+from keyframes import KeyframePropagator
+from postprocess import AlphaPostProcessor
+from video_io import FFmpegReader, FFmpegWriter, probe_video, open_background
+from buffers import BufferRing, MattingBuffers
+from metrics import Metrics, print_progress
 
-def add_foreground_to_background(input_video, background_video, output_video):
-    # Settings
-    device = "cpu"
-    model_path = "models/rvm_mobilenetv3.pth"
-    downsample_ratio = 0.8 # 0-1, higher = better but slower
-    
-    # Load the model
-    model = MattingNetwork("mobilenetv3").eval().to(device)
-    model.load_state_dict(torch.load(model_path, map_location=device))
-
-    # Open foreground video
-    cap_fg = cv2.VideoCapture(input_video)
-    if not cap_fg.isOpened():
-        raise RuntimeError(f"Failed to open input video: {input_video}")
-
-    # Open background video
-    cap_bg = cv2.VideoCapture(background_video)
-    if not cap_bg.isOpened():
-        raise RuntimeError(f"Failed to open background video: {background_video}")
-
-    # Metadata (assuming both videos have same size & fps)
-    fps = cap_fg.get(cv2.CAP_PROP_FPS)
-    width = int(cap_fg.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap_fg.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    frame_count = int(cap_fg.get(cv2.CAP_PROP_FRAME_COUNT))
+def frame_buffers(queue_size, seq_chunk):
+    """
+    Size of the FFmpegReader buffer ring for a render - enough for every frame that can be alive at once
+    (two queues, a model chunk and the frames held by the stages themselves).
+    """
+    return 2 * queue_size + seq_chunk + 4
 
-    # Setup output video writer (no alpha)
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v") # type: ignore
-    print(fourcc)
-    out = cv2.VideoWriter(output_video, fourcc, fps, (width, height))
+def run_model(model, frames, rec, downsample_ratio, device="cpu", buffers=None, metrics=None):
+    """
+    Run the model once over a list of T frames as a [1, T, C, H, W] time series.
+    Returns fgr (T, H, W, 3) RGB and alpha (T, H, W) as uint8 arrays plus the new recurrent state.
+    buffers - MattingBuffers to reuse for the input tensor and the outputs (None = allocate new ones)
+    metrics - Metrics that the preprocess, inference and output stages are timed into
+    """
+    buffers = buffers or MattingBuffers(device=device)
+    metrics = metrics or Metrics(progress=None)
+    with metrics.time("preprocess"):
+        src = buffers.load(frames)
+
+    # Run model
+    #   fgr -> RGB image of person
+    #   alpha -> alpha mask - grayscale image defining how transparent each pixel is
+    #   rec -> recurrent state, passed back in for the next chunk
+    with metrics.time("inference"), torch.no_grad():
+        fgr, alpha, *rec = model(src, *rec, downsample_ratio=downsample_ratio)
+
+    # Convert to numpy
+    with metrics.time("output"):
+        fgr_np, alpha_np = buffers.store(fgr, alpha)
+    return fgr_np, alpha_np, rec
+
+def chunked(items, size):
+    """Group an iterable into lists of up to size items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    # Last partial chunk
+    if chunk:
+        yield chunk
+
+def matte_frames(model, frames, downsample_ratio, seq_chunk=1, device="cpu", buffers=None, metrics=None):
+    """
+    Run the model over an iterable of BGR frames, seq_chunk frames per forward call.
+    The recurrent state is carried across chunks, so any seq_chunk gives the same mattes as frame by frame.
+    Yields (fgr, alpha) per frame.
+    buffers - MattingBuffers to reuse between chunks (None = new arrays for every chunk)
+    metrics - Metrics to time the model stages into
+    """
+    buffers = buffers or MattingBuffers(device=device)
+    metrics = metrics or Metrics(progress=None)
+    rec = [None] * 4
+    for chunk in chunked(frames, seq_chunk):
+        fgr_np, alpha_np, rec = run_model(model, chunk, rec, downsample_ratio, device, buffers, metrics)
+        yield from zip(fgr_np, alpha_np)
+
+def matte_frames_roi(model, frames, downsample_ratio, seq_chunk=1, device="cpu", buffers=None, metrics=None, tracker=None):
+    """
+    Same as matte_frames, but only runs the model on a crop around the person (see roi.py).
+    Every chunk uses the crop picked from the last frame of the chunk before it, and the recurrent state
+    starts over whenever the crop changes. A chunk where the person reaches the edge of the crop is re-run on the full frame.
+    """
+    tracker = tracker or RoiTracker()
+    buffers = buffers or MattingBuffers(device=device)
+    metrics = metrics or Metrics(progress=None)
+    # Crop outputs are pasted straight into the full frames, so one slot is enough
+    crop_buffers = MattingBuffers(0, device)
+    rec = [None] * 4
+    rec_box = None
+
+    for chunk in chunked(frames, seq_chunk):
+        height, width = chunk[0].shape[:2]
+        box = tracker.next_box(chunk[0])
+        if box != rec_box:
+            rec = [None] * 4
+            rec_box = box
 
+        if box is not None:
+            x0, y0, x1, y1 = box
+            fgr_crop, alpha_crop, new_rec = run_model(model, [frame[y0:y1, x0:x1] for frame in chunk], rec, downsample_ratio,
+                                                        device, crop_buffers, metrics)
+            if any(tracker.escaped(alpha, box, width, height) for alpha in alpha_crop):
+                box = rec_box = tracker.box = None
+                rec = [None] * 4
+
+        if box is None:
+            fgr_np, alpha_np, rec = run_model(model, chunk, rec, downsample_ratio, device, buffers, metrics)
+        else:
+            rec = new_rec
+            # Paste the crop back into full frames (outside it - no alpha, and fgr is just the source)
+            fgr_np, alpha_np = buffers.outputs(len(chunk), height, width)
+            for i, frame in enumerate(chunk):
+                np.copyto(fgr_np[i], frame[:, :, ::-1])
+            alpha_np.fill(0)
+            fgr_np[:, y0:y1, x0:x1] = fgr_crop
+            alpha_np[:, y0:y1, x0:x1] = alpha_crop
+
+        tracker.update(alpha_np[-1])
+        yield from zip(fgr_np, alpha_np)
+
+def matte_frames_keyframes(model, frames, downsample_ratio, seq_chunk=1, device="cpu", buffers=None, metrics=None,
+                           propagator=None):
+    """
+    Same as matte_frames, but only runs the model on keyframes and warps their alpha onto the frames in between
+    (see keyframes.py). Frames are matted one at a time, so seq_chunk is ignored. The recurrent state is carried
+    from keyframe to keyframe.
+    """
+    propagator = propagator or KeyframePropagator()
+    buffers = buffers or MattingBuffers(device=device)
+    metrics = metrics or Metrics(progress=None)
     rec = [None] * 4
-    frame_num = 0
 
-    while True:
-        # Is it readable, actual data
-        ret_fg, frame_fg = cap_fg.read()
-        ret_bg, frame_bg = cap_bg.read()
+    for frame in frames:
+        with metrics.time("propagate"):
+            propagate = propagator.check(frame)
+            if propagate:
+                fgr_np, alpha_np = buffers.outputs(1, *frame.shape[:2])
+                propagator.warp(frame, fgr_np[0], alpha_np[0])
+        if not propagate:
+            fgr_np, alpha_np, rec = run_model(model, [frame], rec, downsample_ratio, device, buffers, metrics)
+            propagator.set_keyframe(frame, alpha_np[0])
+        yield fgr_np[0], alpha_np[0]
+
+    if propagator.keyframes:
+        print(f"Ran the model on {propagator.keyframes} keyframes, propagated {propagator.propagated} frames")
+
+def load_weights(model, model_path, device="cpu"):
+    """
+    Load a state dict into model. The pretrained files hold deep_guided_filter refiner weights - the fast
+    guided filter refiners have no weights, so those keys are left out for them.
+    """
+    state = torch.load(model_path, map_location=device)
+    if model.refiner_name != "deep_guided_filter":
+        state = {k: v for k, v in state.items() if not k.startswith("refiner.")}
+    model.load_state_dict(state)
+
+def load_model(model_path="models/rvm_mobilenetv3.pth", variant="mobilenetv3", refiner="deep_guided_filter", device="cpu",
+               precision="fp32", tile_size=None):
+    """
+    Load the pretrained matting network, with BatchNorm folded into the convs.
+    Files saved by export_model are loaded as exported graphs instead - variant and refiner come from the file:
+        .torchscript - frozen TorchScript graph
+        .onnx - ONNX graph run by onnxruntime (CPU only)
+    precision - fp32, bf16 or channels_last (see model/precision.py)
+    model_path=None gives randomly initialised weights (same speed, for benchmarks)
+    tile_size - run the full resolution refiner step in tiles of this many pixels (bounded memory for 4K, see model/tiling.py)
+    """
+    exported = model_path is not None and model_path.endswith((".torchscript", ".onnx"))
+    if exported and precision != "fp32":
+        raise ValueError("Precision modes only apply to the eager model, not to exported graphs")
+    if exported and tile_size:
+        raise ValueError("Tiled refinement only applies to the eager model, not to exported graphs")
+    if exported and model_path.endswith(".torchscript"):
+        return TorchScriptMatting(model_path, device)
+    if exported:
+        return OnnxMatting(model_path)
+
+    model = MattingNetwork(variant, refiner).eval().to(device)
+    if model_path is not None:
+        load_weights(model, model_path, device)
+    model.optimize_for_inference()
+    model.tile_size = tile_size
+    return apply_precision(model, precision)
+
+def read_sample_frames(video, count):
+    """Read up to the first count frames of a video."""
+    reader = FFmpegReader(video)
+    frames = [frame for _, frame in zip(range(count), reader)]
+    reader.release()
+    return frames
+
+def check_precision(sample_video, precision, model_path="models/rvm_mobilenetv3.pth", variant="mobilenetv3",
+                    refiner="deep_guided_filter", downsample_ratio=0.8, sample_frames=60):
+    """
+    Check a precision mode against the fp32 model on the first sample_frames frames of sample_video.
+    Returns the mean absolute error of alpha (0-1 scale) and the fps of both.
+    """
+    frames = read_sample_frames(sample_video, sample_frames)
+    results = {}
+
+    for mode in ["fp32", precision]:
+        model = load_model(model_path, variant, refiner, "cpu", mode)
+        start = time.perf_counter()
+        alphas = np.stack([alpha for _, alpha in matte_frames(model, frames, downsample_ratio)])
+        results[mode] = (alphas, len(frames) / (time.perf_counter() - start))
+
+    reference, fps_ref = results["fp32"]
+    alphas, fps = results[precision]
+    mae = float(np.abs(alphas.astype(np.float32) - reference.astype(np.float32)).mean() / 255)
+    print(f"{precision}: alpha MAE {mae:.5f}, {fps:.1f} fps (fp32: {fps_ref:.1f} fps)")
+    return {"precision": precision, "alpha_mae": mae, "fps": fps, "fp32_fps": fps_ref}
+
+def profile_matting(size=(1920, 1080), downsample_ratio=0.25, model_path="models/rvm_mobilenetv3.pth", variant="mobilenetv3",
+                    refiner="deep_guided_filter", frames=1, runs=5):
+    """
+    Print where the model's time goes per frame at a resolution (width, height) and downsample_ratio -
+    wall time, FLOPs and activation memory of the backbone, LRASPP, decoder blocks, ConvGRUs, projections and refiner.
+    Returns the per-module numbers (see model/profiler.py).
+    """
+    model = load_model(model_path, variant, refiner, "cpu")
+    profiler = profile_model(model, size, downsample_ratio, frames, runs)
+    print(f"{variant} + {refiner}, {size[0]}x{size[1]}, downsample_ratio {downsample_ratio}")
+    print(profiler.report())
+    return profiler.results()
 
-        if not ret_fg or not ret_bg:
-            print("No more frames or error reading frame.")
+def export_model(output_path, model_path="models/rvm_mobilenetv3.pth", variant="mobilenetv3", refiner="deep_guided_filter", downsample_ratio=0.8):
+    """
+    Save the matting network as a graph that load_model can load directly, picked by output_path's extension:
+        .torchscript - frozen TorchScript graph (downsample_ratio is baked in)
+        .onnx - ONNX graph taking downsample_ratio and the recurrent state as inputs
+    """
+    model = MattingNetwork(variant, refiner).eval()
+    load_weights(model, model_path)
+    if output_path.endswith(".onnx"):
+        export_onnx(model, output_path)
+    else:
+        export_torchscript(model, output_path, downsample_ratio)
+    print(f"Saved exported model to: {output_path}")
+
+def matte_shard(input_video, start, end, warmup, entry_dir, chunk_frames, threads, settings, chunk_index=0):
+    """
+    Worker for matte_video_sharded - mattes frames [start, end) of input_video (end=None -> to the end of the video)
+    into the chunk files of entry_dir, numbered from chunk_index. Starts warmup frames early so the recurrent state
+    has settled by frame start. Returns the number of frames written.
+    """
+    torch.set_num_threads(threads)
+    model = load_model(settings["model_path"], settings["variant"], settings["refiner"], "cpu",
+                       settings["precision"], settings["tile_size"])
+
+    first = max(start - warmup, 0)
+    reader = FFmpegReader(input_video, start=first / probe_video(input_video).fps,
+                          buffers=frame_buffers(0, settings["seq_chunk"]))
+    frames = iter(reader)
+    if end is not None:
+        frames = itertools.islice(frames, end - first)
+
+    matte_fn = select_matte_fn(settings["roi"], settings["keyframes"])
+    # The writer copies every matte as soon as it comes out
+    mattes = matte_fn(model, frames, settings["downsample_ratio"], settings["seq_chunk"], "cpu", MattingBuffers(0))
+    writer = MatteWriter(MatteCache(os.path.dirname(entry_dir), chunk_frames=chunk_frames), None, entry_dir, chunk_index)
+    for i, (fgr_np, alpha_np) in enumerate(mattes):
+        # Warm-up frames only feed the recurrent state
+        if i >= start - first:
+            writer.add(fgr_np, alpha_np)
+    writer.finish()
+    reader.release()
+    return writer.frame_count
+
+def matte_video_sharded(input_video, cache, key, workers, warmup, settings):
+    """
+    Matte the settings["start"] - settings["end"] range of input_video on a pool of workers processes, each taking
+    one part of the range, and store the result in cache under key. Returns the stored CachedMattes.
+    """
+    info = probe_video(input_video)
+    first, last = frame_range(info.fps, settings["start"], settings["end"])
+    frame_count = (info.frame_count if last is None else min(last, info.frame_count)) - first
+
+    # Shards start on chunk boundaries so every worker writes whole chunk files, and the last one reads to the end
+    chunk_frames = cache.chunk_frames
+    shard_frames = -(-max(frame_count, 1) // workers)
+    shard_frames = -(-shard_frames // chunk_frames) * chunk_frames
+    starts = list(range(first, first + max(frame_count, 1), shard_frames))
+    ranges = [(start, start + shard_frames) for start in starts[:-1]] + [(starts[-1], last)]
+    threads = max((os.cpu_count() or 1) // len(ranges), 1)
+
+    entry_dir = cache.new_entry_dir()
+    try:
+        with ProcessPoolExecutor(len(ranges)) as pool:
+            futures = [pool.submit(matte_shard, input_video, start, end, warmup, entry_dir, chunk_frames, threads, settings,
+                                   (start - first) // chunk_frames)
+                       for start, end in ranges]
+            counts = [future.result() for future in futures]
+    except BaseException:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        raise
+
+    # Stitch the shards in order - if one came up short (frame count was off), the clip ends there
+    total = 0
+    for (start, end), count in zip(ranges, counts):
+        total += count
+        if end is not None and count < end - start:
+            print(f"Shard starting at frame {start} ended early, stopping at frame {total}")
             break
+    cache.commit_entry(key, entry_dir, total, -(-total // chunk_frames))
+    return cache.load(key)
+
+def frame_range(fps, start=0.0, end=None):
+    """Frame indices [first, last) of the time range [start, end) in seconds (last=None -> to the end)."""
+    return round(start * fps), None if end is None else round(end * fps)
+
+def open_foreground(input_video, start=0.0, end=None, warmup=30, buffers=None):
+    """
+    FFmpegReader over [start, end) seconds of input_video (accurate seek, nothing outside it is decoded), beginning up
+    to warmup frames early so the recurrent state has settled by start.
+    Returns the reader and the number of those pre-roll frames (the preroll of matte_video).
+    """
+    fps = probe_video(input_video).fps
+    first, last = frame_range(fps, start, end)
+    preroll = min(first, warmup)
+    # Half a frame short of the end so the frame at end itself is never included
+    duration = None if last is None else (last - first + preroll - 0.5) / fps
+    return FFmpegReader(input_video, start=(first - preroll) / fps, duration=duration, buffers=buffers), preroll
+
+def skip_frames(mattes, count):
+    """Drop the first count items of the mattes generator (closing it when done)."""
+    try:
+        for i, item in enumerate(mattes):
+            if i >= count:
+                yield item
+    finally:
+        mattes.close()
+
+def select_matte_fn(roi=False, keyframes=False):
+    """The matte_frames variant for the roi / keyframes options."""
+    if roi and keyframes:
+        raise ValueError("roi and keyframes can't be used together")
+    if keyframes:
+        return matte_frames_keyframes
+    return matte_frames_roi if roi else matte_frames
+
+def matte_video(input_video, frames_fg, model_path="models/rvm_mobilenetv3.pth", variant="mobilenetv3",
+                refiner="deep_guided_filter", downsample_ratio=0.8, seq_chunk=1, queue_size=8, device="cpu", cache_dir=None,
+                precision="fp32", roi=False, workers=1, warmup=30, metrics=None, keyframes=False, tile_size=None,
+                start=0.0, end=None, preroll=0):
+    """
+    Yield (fgr, alpha) for every frame of input_video, decoded as frames_fg.
+    With cache_dir set, the mattes of an earlier run with the same video, weights and model settings are read back
+    from disk instead of running the model (frames_fg isn't touched), and new runs are saved there. Random weights
+    (model_path=None) are never cached.
+    With workers > 1, the video is split into time ranges that are matted in parallel processes (CPU only),
+    each starting warmup frames early so the recurrent state has settled by the start of its range.
+    metrics - Metrics to time decoding and the model stages into (not recorded for the worker processes)
+    keyframes - only run the model on keyframes and warp their alpha onto the frames in between (see keyframes.py)
+    tile_size - run the full resolution refiner step in tiles (same mattes, so it isn't part of the cache key)
+    start, end - time range (seconds) of input_video the mattes are for (end=None -> to the end)
+    preroll - the first preroll frames of frames_fg come before start and only warm up the recurrent state
+              (see open_foreground)
+    """
+    metrics = metrics or Metrics(progress=None)
+    settings = {"model_path": model_path, "variant": variant, "refiner": refiner, "downsample_ratio": downsample_ratio,
+                "seq_chunk": seq_chunk, "precision": precision, "roi": roi, "keyframes": keyframes,
+                "tile_size": tile_size, "start": start, "end": end}
 
-        frame_num += 1
-        print(f"Processing frame {frame_num}/{frame_count}")
+    cache = None
+    key = "sharded"
+    if cache_dir is not None and model_path is not None:
+        cache = MatteCache(cache_dir)
+        # roi picks its crop and recurrent state resets once per chunk, so its mattes depend on seq_chunk too
+        chunking = {"seq_chunk": seq_chunk} if roi else {}
+        key = matte_cache_key(input_video, weights=file_hash(model_path), variant=variant,
+                              refiner=refiner, downsample_ratio=downsample_ratio, precision=precision, roi=roi,
+                              keyframes=keyframes, start=start, end=end, **chunking)
+        cached = cache.load(key)
+        if cached is not None:
+            print(f"Using cached mattes for: {input_video}")
+            yield from cached
+            return
 
-        # Prepare the frame for model
-        #   BGR -> RGB
-        #   change shape
-        #   convert float to 0-1
-        #   add a batch dimension in front of chw
-        #   change to CPU
-        src = torch.from_numpy(frame_fg[:, :, ::-1].copy()).permute(2, 0, 1).float() / 255.0
-        src = src.unsqueeze(0).to(device)
+    if workers > 1:
+        # Without a cache the shards are stitched in a temp dir that is deleted afterwards
+        store = cache or MatteCache(tempfile.mkdtemp(), max_bytes=float("inf"))
+        try:
+            yield from matte_video_sharded(input_video, store, key, workers, warmup, settings)
+        finally:
+            if cache is None:
+                shutil.rmtree(store.cache_dir, ignore_errors=True)
+        return
 
-        # Run model
-        #   fgr -> RGB image of person
-        #   alpha -> alpha mask - grayscale image defining how transparent each pixel is
-        with torch.no_grad():
-            fgr, alpha, *rec = model(src, *rec, downsample_ratio=downsample_ratio)
+    model = load_model(model_path, variant, refiner, device, precision, tile_size)
+    # Decode on its own thread
+    matte_fn = select_matte_fn(roi, keyframes)
+    # Mattes still queued for or being composited when the next chunk comes out
+    buffers = MattingBuffers(queue_size + 2, device)
+    frames_fg = prefetch(metrics.timed("decode_fg", frames_fg), queue_size)
+    mattes = matte_fn(model, frames_fg, downsample_ratio, seq_chunk, device, buffers, metrics)
+    if preroll:
+        mattes = skip_frames(mattes, preroll)
+    if cache is not None:
+        mattes = cache.record(key, mattes)
 
-        # Convert to numpy
-        fgr_np = (fgr[0].permute(1, 2, 0).cpu().numpy() * 255).astype(np.uint8)
-        alpha_np = (alpha[0, 0].cpu().numpy() * 255).astype(np.uint8)
+    try:
+        yield from mattes
+    finally:
+        mattes.close()
 
+def composite_video(mattes, frames_bg, write, frame_count=0, queue_size=8, postprocess=None, metrics=None):
+    """
+    Composite each (fgr, alpha) of mattes over the matching frame of frames_bg and pass the result to write.
+    Stops at whichever input runs out first.
+    postprocess - AlphaPostProcessor that cleans up the alpha and composites (default settings if None)
+    metrics - Metrics to time the stages into and report progress through (frame_count is its total)
+    """
+    postprocess = postprocess or AlphaPostProcessor()
+    metrics = metrics or Metrics()
+    metrics.total = frame_count
+    # Pipeline stages (each on its own thread, joined by bounded queues)
+    #   decode fg / decode bg -> inference (this thread) -> alpha post-processing + composite -> encode
+    frames_bg = prefetch(metrics.timed("decode_bg", frames_bg), queue_size)
+    # Composited frames waiting for or being encoded, plus the one being composited
+    outputs = BufferRing(queue_size + 2)
+
+    def composite_stage(item):
+        frame_num, fgr_np, alpha_np, frame_bg = item
         if alpha_np.ndim != 2 or alpha_np.size == 0:
             print(f"Skipping frame {frame_num} due to invalid alpha shape: {alpha_np.shape}")
-            continue
-
-        # Post-process alpha mask
-        #   Smooth edges
-        alpha_np = cv2.bilateralFilter(alpha_np, d=9, sigmaColor=75, sigmaSpace=75)
-        #   Sharpen mask
-        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        alpha_np = cv2.filter2D(alpha_np, -1, kernel)
-        #   Adjust contrast
-        alpha_float = alpha_np.astype(np.float32) / 255.0
-        gamma = 0.8
-        alpha_np = (np.power(alpha_float, gamma) * 255).astype(np.uint8)
-        #   Make edges hard (i.e. no blur -> opaque/transparent)
-        alpha_threshold = 200
-        alpha_np = (alpha_np > alpha_threshold).astype(np.uint8) * 255
-
-        # Normalize alpha mask to 0-1 float for blending
-        alpha_norm = alpha_np.astype(np.float32) / 255.0
-        alpha_3c = np.repeat(alpha_norm[:, :, np.newaxis], 3, axis=2)
-        
-        # Convert model's RGB output to BGR to match OpenCV
-        fgr_bgr = cv2.cvtColor(fgr_np, cv2.COLOR_RGB2BGR)
-
-        # Combine foreground and background
-        composite = (alpha_3c * fgr_bgr.astype(np.float32) + (1 - alpha_3c) * frame_bg.astype(np.float32)).astype(np.uint8)
-
-        # Write combined frame to output
-        out.write(composite)
-
-    # Cleanup
-    cap_fg.release()
-    cap_bg.release()
-    out.release()
+            return
+        with metrics.time("postprocess"):
+            alpha_np = postprocess.filter(alpha_np)
+        with metrics.time("composite"):
+            frame = postprocess.blend(fgr_np, alpha_np, frame_bg, outputs.next(frame_bg.shape))
+        encoder.put(frame)
+
+    def encode_stage(frame):
+        with metrics.time("encode"):
+            write(frame)
+        metrics.frame_done()
+
+    try:
+        with ThreadedSink(encode_stage, queue_size) as encoder, ThreadedSink(composite_stage, queue_size) as compositor:
+            for frame_num, ((fgr_np, alpha_np), frame_bg) in enumerate(zip(mattes, frames_bg), start=1):
+                compositor.put((frame_num, fgr_np, alpha_np, frame_bg))
+    finally:
+        # Stop the decode threads
+        mattes.close()
+        frames_bg.close()
+
+    print("No more frames or error reading frame.")
+
+def add_foreground_to_background(input_video, background_video, output_video, seq_chunk=1, queue_size=8, cache_dir=None,
+                                 model_path="models/rvm_mobilenetv3.pth", precision="fp32", roi=False, workers=1, postprocess=None,
+                                 vcodec="libx264", crf=18, preset="medium", metrics_path=None, progress=print_progress,
+                                 refiner="deep_guided_filter", keyframes=False, tile_size=None, loop_background=True,
+                                 start=0.0, end=None):
+    """
+    Cut the person out of input_video and composite them over background_video.
+    The background can be a video or a still image of any size and fps - it is scaled and center-cropped to fill
+    the frame and resampled to the input's fps while decoding, and a still image is only decoded once.
+    seq_chunk - number of frames decoded and run through the model in a single forward call
+    queue_size - max frames buffered between the decode, inference, composite and encode threads (0 = run everything on one thread)
+    cache_dir - where to cache the model's output, so re-compositing the same input skips the matting pass (None = no cache)
+    model_path - model weights, or a graph saved by export_model (.torchscript, or .onnx to run on onnxruntime)
+    precision - fp32, bf16 or channels_last - use check_precision to see how much accuracy and speed a mode gives
+    roi - only run the model on a crop around the person (faster when they fill a small part of the frame)
+    workers - split the video into this many time ranges and matte them in parallel processes
+    postprocess - AlphaPostProcessor with the alpha clean-up steps to run (None = default steps)
+    vcodec, crf, preset - output encoder settings
+    metrics_path - where to save the per-stage timings at the end (.prom = Prometheus text, otherwise JSON)
+    progress - called as progress(frames, total, fps) about once a second (None = quiet)
+    refiner - full resolution refinement step:
+        deep_guided_filter - best edges, slowest at high resolutions
+        fast_guided_filter - plain guided filter, cheaper at 1080p and up
+        fast_guided_filter_integral - fast_guided_filter with an O(1) per pixel box blur (same matte, about the same speed at r=1)
+    keyframes - only run the model on keyframes and warp their alpha onto the frames in between, falling back to
+                the model when the shot changes too much (faster on static shots, can't be combined with roi)
+    tile_size - run the full resolution refiner step in tiles of this many pixels, so its memory no longer grows
+                with the video size (same output - use e.g. 512 for 4K sources)
+    loop_background - start a background video over when it is shorter than input_video (otherwise the output
+                      ends with the background)
+    start, end - only cut out and composite this time range (seconds) of input_video (end=None -> to the end).
+                 The input is seeked to a short pre-roll before start, so only the range is decoded, run through
+                 the model and encoded. The background starts from its beginning.
+    """
+    # Settings
+    device = "cpu"
+    variant = "mobilenetv3"
+    downsample_ratio = 0.8 # 0-1, higher = better but slower
+
+    # Open foreground and background (fitted to the foreground's size & fps)
+    buffers = frame_buffers(queue_size, seq_chunk)
+    reader_fg, preroll = open_foreground(input_video, start, end, buffers=buffers)
+    reader_bg = open_background(background_video, reader_fg.width, reader_fg.height, reader_fg.fps,
+                                loop=loop_background, buffers=buffers)
+
+    # Setup output video writer (no alpha)
+    writer = FFmpegWriter(output_video, reader_fg.width, reader_fg.height, reader_fg.fps, vcodec=vcodec, crf=crf, preset=preset)
+    metrics = Metrics(progress=progress)
+
+    try:
+        mattes = matte_video(input_video, reader_fg, model_path, variant, refiner, downsample_ratio, seq_chunk,
+                             queue_size, device, cache_dir, precision, roi, workers, metrics=metrics, keyframes=keyframes,
+                             tile_size=tile_size, start=start, end=end, preroll=preroll)
+        composite_video(mattes, reader_bg, writer.write, reader_fg.frame_count - preroll, queue_size, postprocess, metrics)
+    finally:
+        # Cleanup
+        reader_fg.release()
+        reader_bg.release()
+        with metrics.time("encode_flush"):
+            writer.release()
 
     print(f"Saved composited video to: {output_video}")
+    metrics.report()
+    if metrics_path is not None:
+        metrics.save(metrics_path)
 
 #add_foreground_to_background('test.mp4', 'output_final.mp4', 'output_with_cutout.mp4')
\ No newline at end of file
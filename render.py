@@ -0,0 +1,58 @@
+from remove_bg import matte_video, composite_video, frame_buffers, open_foreground
+from video_io import FFmpegWriter, open_background
+from metrics import Metrics, print_progress
+from add_lyrics import subtitle_filter
+
+def render_edit(input_video, background_video, subtitles, audio, output_video, seq_chunk=1, queue_size=8, cache_dir=None,
+                model_path="models/rvm_mobilenetv3.pth", precision="fp32", roi=False, workers=1, postprocess=None,
+                metrics_path=None, progress=print_progress, refiner="deep_guided_filter",
+                keyframes=False, tile_size=None, loop_background=True, start=0.0, end=None):
+    """
+    Single-pass version of burn_subtitles -> add_foreground_to_background -> combine_video_audio.
+    Each input is decoded once and the result is encoded once - frames only move through pipes:
+        background - fitted to the input's size & fps and subtitles burned in while decoding (ffmpeg filters),
+                     can be a video or a still image
+        input_video - person cut out and composited over the background (so the text sits behind them)
+        audio - muxed in by the same ffmpeg process that encodes the output
+    With cache_dir set, the person's mattes are reused across edits of the same clip.
+    model_path - model weights, or a graph saved by export_model (.torchscript, or .onnx to run on onnxruntime)
+    precision - fp32, bf16 or channels_last
+    roi - only run the model on a crop around the person
+    workers - matte time ranges of the video in this many parallel processes
+    postprocess - AlphaPostProcessor with the alpha clean-up steps to run
+    metrics_path - where to save the per-stage timings at the end (.prom = Prometheus text, otherwise JSON)
+    progress - called as progress(frames, total, fps) about once a second (None = quiet)
+    refiner - deep_guided_filter, fast_guided_filter or fast_guided_filter_integral (see add_foreground_to_background)
+    keyframes - only run the model on keyframes and warp their alpha onto the frames in between
+    tile_size - run the full resolution refiner step in tiles of this many pixels (bounded memory for 4K sources)
+    loop_background - start a background video over when it is shorter than input_video
+    start, end - only render this time range (seconds) of input_video (end=None -> to the end). The subtitles and
+                 audio are taken from the same range of their timelines, the background starts from its beginning.
+    """
+    # Settings
+    device = "cpu"
+    variant = "mobilenetv3"
+    downsample_ratio = 0.8 # 0-1, higher = better but slower
+
+    buffers = frame_buffers(queue_size, seq_chunk)
+    reader_fg, preroll = open_foreground(input_video, start, end, buffers=buffers)
+    reader_bg = open_background(background_video, reader_fg.width, reader_fg.height, reader_fg.fps,
+                                vf=subtitle_filter(subtitles, start), loop=loop_background, buffers=buffers)
+    writer = FFmpegWriter(output_video, reader_fg.width, reader_fg.height, reader_fg.fps, audio=audio, audio_start=start)
+    metrics = Metrics(progress=progress)
+
+    try:
+        mattes = matte_video(input_video, reader_fg, model_path, variant, refiner, downsample_ratio, seq_chunk,
+                             queue_size, device, cache_dir, precision, roi, workers, metrics=metrics, keyframes=keyframes,
+                             tile_size=tile_size, start=start, end=end, preroll=preroll)
+        composite_video(mattes, reader_bg, writer.write, reader_fg.frame_count - preroll, queue_size, postprocess, metrics)
+    finally:
+        reader_fg.release()
+        reader_bg.release()
+        with metrics.time("encode_flush"):
+            writer.release()
+
+    print(f"Saved final video to: {output_video}")
+    metrics.report()
+    if metrics_path is not None:
+        metrics.save(metrics_path)
@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+"""
+Region-of-interest tracking for matting - when the person only fills a small part of the frame, the
+network only needs to see a crop around them.
+
+The crop comes from the previous frame's alpha (bounding box plus a margin) and is sticky: it only
+moves when the person gets close to its edge, because every move means the recurrent state (which is
+tied to the crop's size and position) has to start over. Full frame is used whenever the crop can't be
+trusted - on the first frame, on scene changes, when nobody is found, or when the crop would cover most
+of the frame anyway.
+"""
+
+class RoiTracker:
+    """
+    margin - space kept around the person, as a fraction of their bounding box size
+    min_margin - minimum space kept around the person in pixels
+    max_area - use the full frame when the crop would cover more than this fraction of it
+    scene_threshold - mean grayscale difference (0-255) between frames that counts as a scene change
+    alpha_threshold - alpha values (0-255) above this count as part of the person
+    """
+    def __init__(self, margin=0.25, min_margin=32, max_area=0.6, scene_threshold=30, alpha_threshold=16):
+        self.margin = margin
+        self.min_margin = min_margin
+        self.max_area = max_area
+        self.scene_threshold = scene_threshold
+        self.alpha_threshold = alpha_threshold
+        self.box = None
+        self._bbox = None
+        self._thumb = None
+
+    def _subject_bbox(self, alpha):
+        """Bounding box (x0, y0, x1, y1) of the person in a full frame alpha, or None."""
+        mask = alpha > self.alpha_threshold
+        rows = np.flatnonzero(mask.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(mask.any(axis=0))
+        return cols[0], rows[0], cols[-1] + 1, rows[-1] + 1
+
+    def _grow(self, bbox, width, height):
+        """Add the margin around bbox, snapped to a multiple of 16 so small movements give the same crop."""
+        x0, y0, x1, y1 = bbox
+        pad_x = max(int((x1 - x0) * self.margin), self.min_margin)
+        pad_y = max(int((y1 - y0) * self.margin), self.min_margin)
+        x0 = max((x0 - pad_x) // 16 * 16, 0)
+        y0 = max((y0 - pad_y) // 16 * 16, 0)
+        x1 = min(-(-(x1 + pad_x) // 16) * 16, width)
+        y1 = min(-(-(y1 + pad_y) // 16) * 16, height)
+        return x0, y0, x1, y1
+
+    def _inside(self, bbox, box, width, height):
+        """Whether bbox keeps at least half of min_margin away from every edge of box that isn't a frame edge."""
+        clearance = self.min_margin // 2
+        return ((bbox[0] - box[0] >= clearance or box[0] == 0) and
+                (bbox[1] - box[1] >= clearance or box[1] == 0) and
+                (box[2] - bbox[2] >= clearance or box[2] == width) and
+                (box[3] - bbox[3] >= clearance or box[3] == height))
+
+    def next_box(self, frame):
+        """Return the crop (x0, y0, x1, y1) to run the next frame on, or None for the full frame."""
+        height, width = frame.shape[:2]
+
+        # Scene change - whatever was tracked is gone
+        thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36), interpolation=cv2.INTER_AREA)
+        scene_change = self._thumb is not None and np.abs(thumb.astype(np.int16) - self._thumb).mean() > self.scene_threshold
+        self._thumb = thumb
+        if scene_change or self._bbox is None:
+            self.box = None
+            return None
+
+        # Keep the current crop while the person stays clear of its edges
+        if self.box is not None and self._inside(self._bbox, self.box, width, height):
+            return self.box
+
+        box = self._grow(self._bbox, width, height)
+        if (box[2] - box[0]) * (box[3] - box[1]) > self.max_area * width * height:
+            box = None
+        self.box = box
+        return box
+
+    def escaped(self, alpha_crop, box, width, height):
+        """
+        Whether the person has left the crop or touches one of its edges (other than a frame edge),
+        so part of them may be cut off.
+        """
+        if not (alpha_crop > self.alpha_threshold).any():
+            return True
+
+        x0, y0, x1, y1 = box
+        edges = []
+        if x0 > 0:
+            edges.append(alpha_crop[:, 0])
+        if y0 > 0:
+            edges.append(alpha_crop[0, :])
+        if x1 < width:
+            edges.append(alpha_crop[:, -1])
+        if y1 < height:
+            edges.append(alpha_crop[-1, :])
+        return any((edge > self.alpha_threshold).any() for edge in edges)
+
+    def update(self, alpha):
+        """Record where the person is in the full frame alpha of the latest frame."""
+        self._bbox = self._subject_bbox(alpha)
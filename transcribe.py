@@ -1,6 +1,13 @@
+import itertools
+import os
 import whisper
 import json
 import string
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from transcript_cache import TranscriptCache, write_json
+from transcript_format import ColumnarTranscript, split_points
 # from client import client
 
 # ALSO GET THE SOUND AND MAP IT TO THE VIDEO
@@ -48,73 +55,310 @@ def check_importance(words):
     return words
 """
 
-def split_segments(result, max_gap=0.2):
+def _word_arrays(result):
     """
-    Splits whisper segments into smaller segments based on gaps between individual words greater than max_gap.
-    Returns a new list of segments with id, start, end, text, and words.
+    Every word of result as a cleaned copy (upper-cased, punctuation stripped), with their start and end times
+    as arrays and the offset of each segment's first word (the words of segment i are offsets[i]:offsets[i + 1]).
     """
-    new_segments = []
     remove_punct = str.maketrans("", "", string.punctuation)
-    
-    # Go through each segment
+    cleaned = {}
+    words = []
+    offsets = [0]
     for segment in result["segments"]:
-        words = segment.get("words", [])
-        # If no word-level data, keep segment as is
-        if not words:
-            new_segments.append(segment)
-            continue
-
-        words[0]["word"] = words[0]["word"].translate(remove_punct).strip().upper()
-        current_words = [words[0]]
-        current_start = words[0]["start"]
-        current_end = words[0]["end"]
-
-        # Go through each word and eheck gap
-        for i in range(1, len(words)):
-            prev_word = words[i-1]
-            curr_word = words[i]
-            curr_word["word"] = curr_word["word"].translate(remove_punct).strip().upper()
-            gap = curr_word["start"] - prev_word["end"]
-
-            if gap > max_gap:
-                # If gap big enough, close off current subsegment
-                text = " ".join(w["word"].upper() for w in current_words).strip() # Get just words for the text
-                text = text.translate(remove_punct)
-                new_segments.append({
-                    "id": len(new_segments),
-                    "start": current_start,
-                    "end": current_end,
-                    "text": text,
-                    "words": current_words
-                })
-                # Start new subsegment
-                current_words = [curr_word]
-                current_start = curr_word["start"]
-                current_end = curr_word["end"]
-            else:
-                current_words.append(curr_word)
-                current_end = curr_word["end"]
-
-        # Append final subsegment (hasn't been added because no gap to be checked)
-        if current_words:
-            text = "".join(w["word"] for w in current_words).strip()
-            text = text.translate(remove_punct)
-            new_segments.append({
-                "id": len(new_segments),
-                "start": current_start,
-                "end": current_end,
-                "text": text,
-                "words": current_words
-            })
-
-    return new_segments
-
-def transcribe_audio(file_path):
-    model = whisper.load_model('small')
-    result = model.transcribe(file_path, language='en', word_timestamps=True)
-    result["segments"] = split_segments(result, max_gap=0.2)
-    with open("transcript.json", "w") as f: # json over srt because more precision
-        json.dump(result, f, indent=2)
+        for word in segment.get("words", []):
+            text = word["word"]
+            # Lyrics repeat a lot, so each distinct word is only cleaned once
+            if text not in cleaned:
+                cleaned[text] = text.translate(remove_punct).strip().upper()
+            words.append({**word, "word": cleaned[text]})
+        offsets.append(len(words))
+
+    starts = np.array([w["start"] for w in words], dtype=np.float64)
+    ends = np.array([w["end"] for w in words], dtype=np.float64)
+    return words, starts, ends, np.array(offsets, dtype=np.int64)
+
+def _split_words(result, words, starts, ends, offsets, max_gap):
+    """Segments of result split at max_gap, built from index ranges into the words of _word_arrays."""
+    firsts = split_points(starts, ends, offsets, max_gap)
+    lasts = np.append(firsts[1:], len(words))
+    texts = [w["word"] for w in words]
+    segments = [{"id": i, "start": start, "end": end, "text": " ".join(texts[first:last]).strip(), "words": words[first:last]}
+                for i, (first, last, start, end) in enumerate(zip(firsts.tolist(), lasts.tolist(), starts[firsts].tolist(),
+                                                                  ends[lasts - 1].tolist()))]
+
+    # Segments without words are kept as they are (as copies), in their place
+    empty = np.flatnonzero(offsets[:-1] == offsets[1:])
+    if len(empty):
+        positions = np.searchsorted(firsts, offsets[empty], side="left")
+        for n, (position, index) in enumerate(zip(positions.tolist(), empty.tolist())):
+            segments.insert(position + n, dict(result["segments"][index]))
+        for i, segment in enumerate(segments):
+            if segment.get("words"):
+                segment["id"] = i
+    return segments
+
+def split_segments(result, max_gap=0.2):
+    """
+    Splits whisper segments into smaller segments based on gaps between individual words greater than max_gap.
+    Returns a new list of segments with id, start, end, text, and words (result itself isn't changed).
+    A ColumnarTranscript gives a new ColumnarTranscript with the split segments instead.
+    """
+    if isinstance(result, ColumnarTranscript):
+        return result.split(max_gap)
+    if not any(segment.get("words") for segment in result["segments"]):
+        # Nothing to split (e.g. instrumental audio or no word timestamps)
+        return [dict(segment) for segment in result["segments"]]
+    return _split_words(result, *_word_arrays(result), max_gap)
+
+def sweep_split_segments(result, max_gaps):
+    """
+    split_segments of result at every gap in max_gaps, e.g. to compare them while tuning an edit.
+    The words are cleaned and turned into arrays once for all of them (so the results share their word dicts).
+    Returns {max_gap: segments}.
+    """
+    if isinstance(result, ColumnarTranscript):
+        return {max_gap: result.split(max_gap) for max_gap in max_gaps}
+    if not any(segment.get("words") for segment in result["segments"]):
+        return {max_gap: [dict(segment) for segment in result["segments"]] for max_gap in max_gaps}
+    arrays = _word_arrays(result)
+    return {max_gap: _split_words(result, *arrays, max_gap) for max_gap in max_gaps}
+
+# Model of a TranscriptionService worker process, loaded once when the process starts
+_worker_model = None
+
+def _init_worker(model_size, device, threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = whisper.load_model(model_size, device=device)
+
+# CHUNKING -------------------------
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+def quiet_points(audio, chunk_seconds, search_seconds=5.0, frame_seconds=0.05):
+    """
+    Sample indices to cut audio (whisper.load_audio samples) at - one about every chunk_seconds, each at the
+    quietest frame_seconds frame within search_seconds of where it would fall, so cuts land in pauses.
+    """
+    frame = int(frame_seconds * SAMPLE_RATE)
+    energy = np.square(audio[:len(audio) // frame * frame].reshape(-1, frame)).mean(axis=1)
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    # Cuts have to move forward
+    search = min(int(search_seconds * SAMPLE_RATE), chunk // 2)
+    points = []
+    cut = 0
+    # The last chunk can run up to search_seconds long rather than leaving a tiny one
+    while len(audio) - cut > chunk + search:
+        low, high = (cut + chunk - search) // frame, (cut + chunk + search) // frame
+        cut = (low + int(np.argmin(energy[low:high]))) * frame + frame // 2
+        points.append(cut)
+    return points
+
+def chunk_audio(audio, chunk_seconds=60.0, overlap_seconds=2.0):
+    """
+    Split audio at quiet points into chunks that overlap by overlap_seconds on each side of every cut
+    (so words at a cut are heard whole by both chunks).
+    Returns (samples, offset, keep_from, keep_to) per chunk - offset is the chunk's start in seconds, and words
+    with their middle in [keep_from, keep_to) belong to this chunk (the cut is the boundary between chunks).
+    """
+    cuts = [0] + quiet_points(audio, chunk_seconds) + [len(audio)]
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    chunks = []
+    for i in range(len(cuts) - 1):
+        start, end = max(cuts[i] - overlap, 0), min(cuts[i + 1] + overlap, len(audio))
+        keep_from = cuts[i] / SAMPLE_RATE if i > 0 else float("-inf")
+        keep_to = cuts[i + 1] / SAMPLE_RATE if i < len(cuts) - 2 else float("inf")
+        chunks.append((audio[start:end], start / SAMPLE_RATE, keep_from, keep_to))
+    return chunks
+
+def merge_chunks(results, chunks):
+    """
+    Combine the whisper results of chunk_audio's chunks into one result on the full audio's timeline.
+    Timestamps are shifted by each chunk's offset and every word (or segment, without word timestamps) is only
+    kept by the chunk its middle falls in, which drops the copies transcribed twice in the overlaps.
+    """
+    segments = []
+    for result, (_, offset, keep_from, keep_to) in zip(results, chunks):
+        for segment in result["segments"]:
+            words = segment.get("words")
+            if words is None:
+                if keep_from <= offset + (segment["start"] + segment["end"]) / 2 < keep_to:
+                    segments.append({**segment, "id": len(segments), "start": segment["start"] + offset,
+                                     "end": segment["end"] + offset})
+                continue
+
+            words = [{**w, "start": w["start"] + offset, "end": w["end"] + offset} for w in words]
+            words = [w for w in words if keep_from <= (w["start"] + w["end"]) / 2 < keep_to]
+            if words:
+                segments.append({**segment, "id": len(segments), "start": words[0]["start"], "end": words[-1]["end"],
+                                 "text": "".join(w["word"] for w in words), "words": words})
+
+    return {"text": "".join(segment["text"] for segment in segments), "segments": segments,
+            "language": results[0]["language"] if results else None}
+
+def _transcribe_in_worker(file_path, options):
+    return _worker_model.transcribe(file_path, **options)
+
+class TranscriptionService:
+    """
+    Transcribes audio files with whisper models that stay loaded between calls.
+    model_size - whisper model (tiny, base, small, medium, large, ...)
+    workers - number of files transcribed in parallel, each worker process holding its own model (1 = one model in this process)
+    threads - torch threads per worker (None = the CPU cores split between the workers)
+    device - where the models run (None = whisper's default, cuda if available)
+    language, word_timestamps - passed on to whisper's transcribe
+    cache_dir - where to cache transcripts by audio contents and settings, so files seen before aren't transcribed
+                again (None = no cache, see transcript_cache.py)
+    chunk_seconds - split audio longer than this at quiet points into chunks that are transcribed in parallel on
+                    the workers, overlapping by overlap_seconds around every cut (None = whole files)
+    Models are loaded on first use. Use as a context manager (or call close()) to stop the workers.
+    """
+    def __init__(self, model_size="small", workers=1, threads=None, device=None, language="en", word_timestamps=True,
+                 cache_dir=None, chunk_seconds=None, overlap_seconds=2.0):
+        self.model_size = model_size
+        self.workers = workers
+        self.threads = threads
+        self.device = device
+        self.options = {"language": language, "word_timestamps": word_timestamps}
+        self.cache = TranscriptCache(cache_dir) if cache_dir is not None else None
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self._model = None
+        self._pool = None
+
+    def _local_model(self):
+        if self._model is None:
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            self._model = whisper.load_model(self.model_size, device=self.device)
+        return self._model
+
+    def _worker_pool(self):
+        if self._pool is None:
+            threads = self.threads or max((os.cpu_count() or 1) // self.workers, 1)
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                             initargs=(self.model_size, self.device, threads))
+        return self._pool
+
+    def _run_whisper(self, inputs):
+        """Raw whisper results of inputs (file paths or audio arrays), in order - spread over the workers as they free up."""
+        if self.workers > 1:
+            return list(self._worker_pool().map(_transcribe_in_worker, inputs, [self.options] * len(inputs)))
+        model = self._local_model()
+        return [model.transcribe(audio, **self.options) for audio in inputs]
+
+    def _transcribe_files(self, file_paths):
+        """Raw whisper results of file_paths, long files cut into chunks when chunk_seconds is set."""
+        if self.chunk_seconds is None:
+            return self._run_whisper(file_paths)
+        if self.workers == 1:
+            results = []
+            for file_path in file_paths:
+                chunks = chunk_audio(whisper.load_audio(file_path), self.chunk_seconds, self.overlap_seconds)
+                results.append(merge_chunks(self._run_whisper([samples for samples, *_ in chunks]), chunks))
+            return results
+
+        # Files are only loaded and chunked as the workers free up, so at most a few chunks per worker (plus the
+        # file being cut) are in memory however large the batch is
+        def chunk_tasks():
+            for i, file_path in enumerate(file_paths):
+                chunks = chunk_audio(whisper.load_audio(file_path), self.chunk_seconds, self.overlap_seconds)
+                # merge_chunks only needs the offsets, so the samples aren't kept once they are sent off
+                file_chunks[i] = [(None, *rest) for _, *rest in chunks]
+                chunk_results[i] = [None] * len(chunks)
+                for j, (samples, *_) in enumerate(chunks):
+                    yield i, j, samples
+
+        pool = self._worker_pool()
+        results = [None] * len(file_paths)
+        file_chunks = {}
+        chunk_results = {}
+        pending = {}
+        tasks = chunk_tasks()
+        while True:
+            for i, j, samples in itertools.islice(tasks, 2 * self.workers - len(pending)):
+                pending[pool.submit(_transcribe_in_worker, samples, self.options)] = (i, j)
+            if not pending:
+                return results
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, j = pending.pop(future)
+                chunk_results[i][j] = future.result()
+                if all(result is not None for result in chunk_results[i]):
+                    results[i] = merge_chunks(chunk_results.pop(i), file_chunks.pop(i))
+
+    def transcribe(self, file_path, max_gap=0.2):
+        """Whisper result for one file, with its segments split at pauses longer than max_gap (see split_segments)."""
+        return self.transcribe_batch([file_path], max_gap)[0]
+
+    def transcribe_batch(self, file_paths, max_gap=0.2):
+        """
+        Results of transcribe for every file, in the same order.
+        With a cache, finished transcripts are read back, files only transcribed with another max_gap are re-split
+        from their raw result, and only the rest goes through whisper.
+        """
+        results = [None] * len(file_paths)
+        raw = {}
+        keys = [None] * len(file_paths)
+        if self.cache is not None:
+            for i, file_path in enumerate(file_paths):
+                keys[i] = self.cache.keys(file_path, max_gap, model_size=self.model_size, chunk_seconds=self.chunk_seconds,
+                                          overlap_seconds=self.overlap_seconds, **self.options)
+                results[i] = self.cache.load(keys[i][1])
+                if results[i] is None:
+                    raw[i] = self.cache.load(keys[i][0])
+
+        missing = [i for i, result in enumerate(results) if result is None and raw.get(i) is None]
+        for i, result in zip(missing, self._transcribe_files([file_paths[i] for i in missing])):
+            raw[i] = result
+            if keys[i] is not None:
+                self.cache.store(keys[i][0], result)
+
+        # The raw results are stored (or not needed again) by now, so their segments can be replaced
+        for i, result in raw.items():
+            if result is None:
+                continue
+            result["segments"] = split_segments(result, max_gap=max_gap)
+            results[i] = result
+            if keys[i] is not None:
+                self.cache.store(keys[i][1], result)
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._model = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+# In-process services shared by transcribe_audio calls, so the model is only loaded once per size
+_services = {}
+
+def get_service(model_size="small", cache_dir=None):
+    if (model_size, cache_dir) not in _services:
+        _services[model_size, cache_dir] = TranscriptionService(model_size, cache_dir=cache_dir)
+    return _services[model_size, cache_dir]
+
+def transcribe_audio(file_path, model_size="small", service=None, output="transcript.json", cache_dir=None, max_gap=0.2):
+    """
+    Transcribe file_path into output (written atomically, so parallel jobs with different outputs don't clash).
+    output - .json for whisper's full result, any other extension for the compact columnar format (transcript_format.py)
+    service - TranscriptionService to use instead of the shared one
+    cache_dir - transcript cache of the shared service (None = no cache)
+    Returns the result.
+    """
+    result = (service or get_service(model_size, cache_dir)).transcribe(file_path, max_gap=max_gap)
+    # json over srt because more precision
+    if output.endswith(".json"):
+        write_json(output, result, indent=2)
+    else:
+        ColumnarTranscript.from_result(result).save(output)
+    return result
 
 # IMPLEMENTATION -------------------------
 #transcribe_audio('audio.MP4')
\ No newline at end of file
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import uuid
+from matte_cache import file_hash
+
+"""
+On-disk cache of whisper transcripts, so songs that are reused across edits are only transcribed once.
+
+Entries are JSON files named by a key built from the audio's contents and the settings that change the result:
+    raw - whisper's own result (model size, language, word_timestamps, chunking)
+    split - the result after split_segments (the same settings plus max_gap)
+Re-splitting with a different max_gap only needs the raw entry, not another whisper run.
+Files are written to a temp file and renamed, so a reader never sees a partial entry, and the least recently
+used entries are evicted once the cache grows past max_bytes.
+"""
+
+def transcript_key(audio_hash, **settings):
+    """Cache key covering the audio's contents (file_hash) and every setting that changes the transcript."""
+    payload = json.dumps({"audio": audio_hash, **settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+def write_json(path, data, indent=None):
+    """Write data as JSON to path atomically (temp file in the same directory, then renamed over path)."""
+    tmp_path = os.path.join(os.path.dirname(path) or ".", f".tmp-{uuid.uuid4().hex}.json")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=indent)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class TranscriptCache:
+    """
+    cache_dir - where entries are stored
+    max_bytes - total size the cache is trimmed back to after each new entry
+    """
+    def __init__(self, cache_dir="cache/transcripts", max_bytes=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def keys(self, audio_path, max_gap, **settings):
+        """The (raw, split) keys of audio_path transcribed with settings (everything that changes whisper's result)."""
+        audio_hash = file_hash(audio_path)
+        return (transcript_key(audio_hash, kind="raw", **settings),
+                transcript_key(audio_hash, kind="split", max_gap=max_gap, **settings))
+
+    def load(self, key):
+        """Return the result stored under key, or None."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        # Mark as recently used for eviction
+        os.utime(path)
+        return result
+
+    def store(self, key, result):
+        write_json(self._path(key), result)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".json") and not entry.name.startswith(".tmp-"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
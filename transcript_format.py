@@ -0,0 +1,242 @@
+import json
+import os
+import string
+import uuid
+import numpy as np
+
+"""
+Compact columnar transcripts - only what the subtitle steps use (word text and timings, segment boundaries),
+stored as flat arrays that are memory-mapped when loaded instead of parsed.
+
+File layout (all arrays little-endian, each starting on a 64 byte boundary):
+    MAGIC (8 bytes), header length (uint64), JSON header - language, text and where each array is
+    word_start, word_end - float64 seconds
+    word_probability - float32 (NaN where whisper gave none)
+    word_text - int32 index into the string table
+    segment_offsets - int64, words of segment i are [segment_offsets[i], segment_offsets[i + 1])
+    segment_start, segment_end - float64 seconds
+    segment_text - int32 index into the string table
+    string_offsets, string_data - string table, string i is string_data[string_offsets[i]:string_offsets[i + 1]] (UTF-8)
+Every distinct string is stored once, so the words of a song's repeated lines share their entries.
+
+load_transcript reads either this format or whisper's JSON, telling them apart by the magic bytes.
+"""
+
+MAGIC = b"CIGTWT01"
+ALIGN = 64
+ARRAYS = [
+    ("word_start", "<f8"),
+    ("word_end", "<f8"),
+    ("word_probability", "<f4"),
+    ("word_text", "<i4"),
+    ("segment_offsets", "<i8"),
+    ("segment_start", "<f8"),
+    ("segment_end", "<f8"),
+    ("segment_text", "<i4"),
+    ("string_offsets", "<i8"),
+    ("string_data", "u1"),
+]
+
+def _align(n):
+    return -(-n // ALIGN) * ALIGN
+
+def split_points(word_start, word_end, segment_offsets, max_gap):
+    """
+    Index of the first word of every segment after splitting wherever the gap between two words is larger than
+    max_gap (segments start at segment_offsets too, so words of different segments are never merged).
+    """
+    count = len(word_start)
+    breaks = np.zeros(count, dtype=bool)
+    breaks[1:] = word_start[1:] - word_end[:-1] > max_gap
+    firsts = segment_offsets[:-1]
+    breaks[firsts[firsts < count]] = True
+    return np.flatnonzero(breaks)
+
+class StringTable:
+    """Interns strings while a table is built - each distinct string gets one id."""
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, text):
+        if text not in self.ids:
+            self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return self.ids[text]
+
+    def arrays(self):
+        """(string_offsets, string_data) of the table."""
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+class ColumnarTranscript:
+    """
+    Transcript as arrays (see the module docstring for what each one holds).
+    Build one with from_result, write it with save and read it back (memory-mapped) with load or load_transcript.
+    """
+    def __init__(self, language, text, arrays):
+        self.language = language
+        self.text = text
+        for name, _ in ARRAYS:
+            setattr(self, name, arrays[name])
+        self._strings = None
+
+    @classmethod
+    def from_result(cls, result):
+        """Columnar copy of a whisper-style result (segments with words)."""
+        table = StringTable()
+        columns = {name: [] for name, _ in ARRAYS[:8]}
+        columns["segment_offsets"].append(0)
+        for segment in result["segments"]:
+            for word in segment.get("words", []):
+                columns["word_start"].append(word["start"])
+                columns["word_end"].append(word["end"])
+                columns["word_probability"].append(word.get("probability", np.nan))
+                columns["word_text"].append(table.add(word["word"]))
+            columns["segment_offsets"].append(len(columns["word_start"]))
+            columns["segment_start"].append(segment["start"])
+            columns["segment_end"].append(segment["end"])
+            columns["segment_text"].append(table.add(segment.get("text", "")))
+
+        arrays = {name: np.array(columns[name], dtype=dtype) for name, dtype in ARRAYS[:8]}
+        arrays["string_offsets"], arrays["string_data"] = table.arrays()
+        return cls(result.get("language"), result.get("text", ""), arrays)
+
+    @property
+    def strings(self):
+        """The decoded string table (decoded once, on first use)."""
+        if self._strings is None:
+            data = self.string_data.tobytes()
+            offsets = self.string_offsets.tolist()
+            self._strings = [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        return self._strings
+
+    def __len__(self):
+        """Number of words."""
+        return len(self.word_start)
+
+    def words(self):
+        """(text, start, end) of every word, in order."""
+        strings = self.strings
+        return zip([strings[i] for i in self.word_text.tolist()], self.word_start.tolist(), self.word_end.tolist())
+
+    def to_result(self):
+        """Whisper-style result dict (only the fields this format keeps)."""
+        strings = self.strings
+        words = [{"word": strings[t], "start": s, "end": e} for t, s, e in
+                 zip(self.word_text.tolist(), self.word_start.tolist(), self.word_end.tolist())]
+        for word, probability in zip(words, self.word_probability.tolist()):
+            if probability == probability:
+                word["probability"] = probability
+
+        offsets = self.segment_offsets.tolist()
+        segments = [{"id": i, "start": s, "end": e, "text": strings[t], "words": words[offsets[i]:offsets[i + 1]]}
+                    for i, (s, e, t) in enumerate(zip(self.segment_start.tolist(), self.segment_end.tolist(),
+                                                      self.segment_text.tolist()))]
+        return {"text": self.text, "segments": segments, "language": self.language}
+
+    def split(self, max_gap=0.2):
+        """
+        split_segments for this format - a new transcript whose segments are split wherever the gap between two
+        words is larger than max_gap, with the words upper-cased and stripped of punctuation.
+        Segments without words are kept as they are.
+        """
+        if len(self.word_start) == 0:
+            # Nothing to split (e.g. instrumental audio or no word timestamps)
+            return ColumnarTranscript(self.language, self.text, {name: getattr(self, name) for name, _ in ARRAYS})
+        remove_punct = str.maketrans("", "", string.punctuation)
+        table = StringTable()
+        # Cleaning works on the distinct strings only, then the word ids are mapped over
+        cleaned = np.array([table.add(s.translate(remove_punct).strip().upper()) for s in self.strings], dtype=np.int32)
+        word_text = cleaned[self.word_text] if len(cleaned) else self.word_text.copy()
+
+        count = len(self.word_start)
+        offsets = self.segment_offsets
+        starts = split_points(self.word_start, self.word_end, offsets, max_gap)
+        ends = np.append(starts[1:], count)
+
+        segment_start = self.word_start[starts]
+        segment_end = self.word_end[ends - 1]
+        strings = table.strings
+        word_ids = word_text.tolist()
+        segment_text = np.array([table.add(" ".join(strings[i] for i in word_ids[s:e]).strip())
+                                 for s, e in zip(starts.tolist(), ends.tolist())], dtype=np.int32)
+
+        # Put the segments without words back where they were
+        empty = np.flatnonzero(offsets[:-1] == offsets[1:])
+        if len(empty):
+            at = np.searchsorted(starts, offsets[empty])
+            starts = np.insert(starts, at, offsets[empty])
+            segment_start = np.insert(segment_start, at, self.segment_start[empty])
+            segment_end = np.insert(segment_end, at, self.segment_end[empty])
+            segment_text = np.insert(segment_text, at, [table.add(self.strings[i]) for i in self.segment_text[empty].tolist()])
+
+        arrays = {
+            "word_start": self.word_start, "word_end": self.word_end, "word_probability": self.word_probability,
+            "word_text": word_text, "segment_offsets": np.append(starts, count).astype(np.int64),
+            "segment_start": segment_start, "segment_end": segment_end, "segment_text": segment_text,
+        }
+        arrays["string_offsets"], arrays["string_data"] = table.arrays()
+        return ColumnarTranscript(self.language, self.text, arrays)
+
+    def save(self, path):
+        """Write the transcript to path (through a temp file that is renamed over path, so it appears complete)."""
+        arrays = [np.ascontiguousarray(getattr(self, name), dtype=dtype) for name, dtype in ARRAYS]
+        layout = {}
+        offset = 0
+        for (name, _), array in zip(ARRAYS, arrays):
+            layout[name] = [offset, len(array)]
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({"language": self.language, "text": self.text, "arrays": layout}).encode("utf-8")
+        data_start = _align(len(MAGIC) + 8 + len(header))
+
+        tmp_path = os.path.join(os.path.dirname(path) or ".", f".tmp-{uuid.uuid4().hex}")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(MAGIC)
+                f.write(np.uint64(len(header)).tobytes())
+                f.write(header)
+                for (name, _), array in zip(ARRAYS, arrays):
+                    f.seek(data_start + layout[name][0])
+                    f.write(array.tobytes())
+                f.truncate(data_start + offset)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Open a saved transcript - the arrays are read-only memory maps of the file."""
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        if data[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError(f"Not a columnar transcript: {path}")
+        header_length = int(data[len(MAGIC):len(MAGIC) + 8].view("<u8")[0])
+        header = json.loads(data[len(MAGIC) + 8:len(MAGIC) + 8 + header_length].tobytes())
+        data_start = _align(len(MAGIC) + 8 + header_length)
+
+        arrays = {}
+        for name, dtype in ARRAYS:
+            offset, length = header["arrays"][name]
+            arrays[name] = np.ndarray((length,), dtype=dtype, buffer=data, offset=data_start + offset)
+        return cls(header["language"], header["text"], arrays)
+
+def is_columnar(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def load_transcript(path):
+    """A ColumnarTranscript for files in this format, otherwise the parsed JSON."""
+    if is_columnar(path):
+        return ColumnarTranscript.load(path)
+    with open(path) as f:
+        return json.load(f)
+
+def transcript_words(transcript):
+    """(text, start, end) of every word of a ColumnarTranscript or whisper-style result."""
+    if isinstance(transcript, ColumnarTranscript):
+        return transcript.words()
+    return ((word["word"], word["start"], word["end"]) for segment in transcript["segments"] for word in segment["words"])
@@ -0,0 +1,244 @@
+import itertools
+import math
+import ffmpeg
+import numpy as np
+from collections import namedtuple
+
+"""
+Frame I/O through ffmpeg rawvideo pipes, so frames can move between ffmpeg and Python without
+intermediate files. Frames are BGR uint8 (H, W, 3) arrays, same as OpenCV.
+
+Decoded frames are read straight from the pipe into numpy buffers (no intermediate bytes objects), and
+can reuse a fixed ring of buffers instead of allocating one per frame. Encoding uses a real codec
+(libx264 by default) rather than OpenCV's mp4v, so the output doesn't need another re-encode.
+
+Backgrounds (open_background) don't have to match the video they go behind - they are scaled, cropped and
+resampled to its size and fps by ffmpeg while decoding, short videos loop, and still images are decoded once.
+"""
+
+VideoInfo = namedtuple("VideoInfo", ["width", "height", "fps", "frame_count", "duration", "start_time"])
+
+def _parse_rate(rate):
+    num, den = rate.split("/")
+    return float(num) / float(den) if float(den) else 0.0
+
+def probe_video(path):
+    """Return the VideoInfo of the first video stream in path."""
+    info = ffmpeg.probe(path)
+    stream = next((s for s in info["streams"] if s["codec_type"] == "video"), None)
+    if stream is None:
+        raise RuntimeError(f"No video stream in: {path}")
+
+    fps = _parse_rate(stream["avg_frame_rate"]) or _parse_rate(stream["r_frame_rate"])
+    duration = float(stream.get("duration") or info["format"].get("duration") or 0)
+    # Not every container stores the frame count - count the packets instead (demux only, no decoding)
+    frame_count = int(stream.get("nb_frames") or 0)
+    if not frame_count:
+        counted = ffmpeg.probe(path, select_streams="v:0", count_packets=None)
+        frame_count = int(counted["streams"][0].get("nb_read_packets", 0))
+    return VideoInfo(int(stream["width"]), int(stream["height"]), fps, frame_count, duration,
+                     float(stream.get("start_time") or 0))
+
+def probe_timestamps(path):
+    """Presentation timestamps (seconds, ascending) of every frame of the first video stream in path."""
+    info = ffmpeg.probe(path, select_streams="v:0", show_entries="packet=pts_time")
+    return np.sort(np.array([float(p["pts_time"]) for p in info.get("packets", []) if p.get("pts_time") not in (None, "N/A")]))
+
+class FFmpegReader:
+    """
+    Decode a video through an ffmpeg rawvideo pipe.
+    vf - optional ffmpeg filter graph applied while decoding (e.g. "ass=subtitles.ass")
+    size - (width, height) of the frames coming out of vf, if it changes the size
+    fps - frame rate coming out of vf, if it changes the rate
+    start - time (seconds) to start from; the seek is frame accurate
+    duration - seconds to decode from start (None = to the end)
+    buffers - number of frame buffers to cycle through, or None to allocate a new one per frame.
+              Frames are only valid until the reader wraps around to their buffer again, so this must be
+              larger than the number of frames alive at once (e.g. sitting in queues).
+    input_args - extra options for the ffmpeg input (e.g. {"stream_loop": -1})
+    """
+    def __init__(self, path, vf=None, size=None, fps=None, start=0.0, duration=None, buffers=None, input_args=None):
+        self.path = path
+        self.vf = vf
+        self.buffers = buffers
+        self.input_args = input_args or {}
+        self.duration = duration
+        self.info = probe_video(path)
+        self.width, self.height = size or (self.info.width, self.info.height)
+        self.fps = fps or self.info.fps
+        self.frame_size = self.width * self.height * 3
+        self.process = None
+        self._stopped = False
+        self._ring = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(buffers or 0)]
+        self.seek(start)
+
+    @property
+    def frame_count(self):
+        """Number of frames left from the seek position."""
+        if self.fps != self.info.fps:
+            count = max(round((self.info.duration - self.start) * self.fps), 0)
+        else:
+            count = max(self.info.frame_count - round(self.start * self.fps), 0)
+        if self.duration is not None:
+            count = min(count, math.ceil(self.duration * self.fps - 1e-6))
+        return count
+
+    def timestamps(self):
+        """Presentation timestamps (seconds) of the frames this reader returns, in order."""
+        timestamps = probe_timestamps(self.path)
+        return timestamps[timestamps >= self.info.start_time + self.start - 0.5 / max(self.fps, 1)]
+
+    def seek(self, start):
+        """Restart decoding at start (seconds)."""
+        self._stop()
+        self.start = start
+        self.frame_index = 0
+
+        input_args = dict(self.input_args)
+        if start > 0:
+            input_args["ss"] = start
+        if self.duration is not None:
+            input_args["t"] = self.duration
+        output_args = {"format": "rawvideo", "pix_fmt": "bgr24", "fps_mode": "passthrough"}
+        if self.vf:
+            output_args["vf"] = self.vf
+        self.process = (
+            ffmpeg.input(self.path, **input_args)
+            .output("pipe:", **output_args)
+            .global_args("-loglevel", "error", "-nostdin")
+            .run_async(pipe_stdout=True)
+        )
+        self._stopped = False
+
+    def read(self):
+        """Return the next frame, or None once the video runs out. Raises RuntimeError if ffmpeg fails."""
+        process = self.process
+        if self._ring:
+            frame = self._ring[self.frame_index % len(self._ring)]
+        else:
+            frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+        view = memoryview(frame).cast("B")
+        filled = 0
+        while filled < self.frame_size:
+            n = process.stdout.readinto(view[filled:])
+            if not n:
+                # End of the pipe - either the video ran out or ffmpeg failed (bad input, filter or subtitles)
+                if process.wait() != 0 and not self._stopped:
+                    raise RuntimeError(f"ffmpeg failed to decode: {self.path}")
+                return None
+            filled += n
+        self.frame_index += 1
+        return frame
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def _stop(self):
+        if self.process is None:
+            return
+        # Killed rather than asked to stop, so an early stop doesn't make ffmpeg complain about the closed pipe
+        self._stopped = True
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.process = None
+
+    def release(self):
+        self._stop()
+
+class StillFrames:
+    """The same frame over and over, with the FFmpegReader interface (for a background that never changes)."""
+    def __init__(self, frame, fps):
+        self.frame = frame
+        self.height, self.width = frame.shape[:2]
+        self.fps = fps
+        self.frame_count = 0
+
+    def read(self):
+        return self.frame
+
+    def __iter__(self):
+        return itertools.repeat(self.frame)
+
+    def release(self):
+        pass
+
+def fit_filter(width, height):
+    """ffmpeg filters that scale and center-crop frames to fill width x height (keeping their aspect ratio)."""
+    return f"scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height},setsar=1"
+
+def open_background(path, width, height, fps, vf=None, loop=True, buffers=None):
+    """
+    Open path (a video or a still image) as the background of a width x height video at fps.
+    Frames are scaled and center-cropped to fill the size, and resampled to fps (both only when they differ).
+        still image / single frame video - decoded once and returned for every frame (StillFrames)
+        video - decoded through an FFmpegReader, looping forever when loop (otherwise it ends with the video)
+    vf - extra filter graph applied after the resizing (e.g. "ass=subtitles.ass"). A still with a filter
+         that changes over time is looped by ffmpeg instead of being decoded once.
+    Returns a reader to iterate and release().
+    """
+    info = probe_video(path)
+    still = info.frame_count <= 1
+    resize = [fit_filter(width, height)] if (info.width, info.height) != (width, height) else []
+
+    if still and vf is None:
+        reader = FFmpegReader(path, vf=",".join(resize) or None, size=(width, height))
+        frame = reader.read()
+        reader.release()
+        if frame is None:
+            raise RuntimeError(f"Could not decode background: {path}")
+        return StillFrames(frame, fps)
+
+    # Resample first so frames that get dropped aren't scaled
+    filters = []
+    input_args = {}
+    if still:
+        # Repeat the one frame with the loop filter (works for images and single frame video files alike) and
+        # time it at fps, so time based filters like subtitles line up with the video
+        filters.append(f"loop=loop=-1:size=1,setpts=N/({fps}*TB)")
+    else:
+        input_args = {"stream_loop": -1} if loop else {}
+        if abs(info.fps - fps) > 1e-3:
+            filters.append(f"fps={fps}")
+    filters += resize + ([vf] if vf else [])
+    return FFmpegReader(path, vf=",".join(filters) or None, size=(width, height), fps=fps, buffers=buffers,
+                        input_args=input_args)
+
+class FFmpegWriter:
+    """
+    Encode frames through an ffmpeg rawvideo pipe.
+    audio - optional file whose audio track is muxed in (cut to the shorter of video and audio)
+    audio_start - time (seconds) in audio the muxed track starts from
+    vcodec, crf, preset - encoder settings
+    output_args - extra options for the ffmpeg output
+    """
+    def __init__(self, path, width, height, fps, audio=None, vcodec="libx264", crf=18, preset="medium", output_args=None,
+                 audio_start=0.0):
+        self.path = path
+        self.width = width
+        self.height = height
+
+        video = ffmpeg.input("pipe:", format="rawvideo", pix_fmt="bgr24", s=f"{width}x{height}", framerate=fps)
+        output_args = {"vcodec": vcodec, "pix_fmt": "yuv420p", "crf": crf, "preset": preset, **(output_args or {})}
+        if audio is not None:
+            audio = ffmpeg.input(audio, ss=audio_start) if audio_start else ffmpeg.input(audio)
+            stream = ffmpeg.output(video.video, audio.audio, path, acodec="aac", shortest=None, **output_args)
+        else:
+            stream = ffmpeg.output(video, path, **output_args)
+        self.process = stream.global_args("-y", "-loglevel", "error").run_async(pipe_stdin=True)
+
+    def write(self, frame):
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f"Expected a {self.width}x{self.height} BGR frame, got shape {frame.shape}")
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode: {self.path}")